@@ -62,13 +62,17 @@ if os.path.exists(configfile):
 else:
     db = database.Database(database.MongoDatabase(overwrite=False))
 
-publications = db.get_collection('publications')
-
-#coauthors = get_coauthors(publications)
+#coauthors = get_coauthors(db.iter_collection('publications'))
 
 #db.add('coauthors', list(coauthors.values()))
 
-dois = [i['DOI'] for i in publications if i['DOI'].find('nodoi') == -1]
+# only the dois are needed here, so stream them rather than loading
+# the full publication records
+dois = [
+    i['DOI']
+    for i in db.iter_collection('publications', fields=['DOI'])
+    if i['DOI'].find('nodoi') == -1
+]
 recs = [Works().doi(doi) for doi in dois]
 print(len(recs))
 goodrecs = [rec for rec in recs if rec is not None]
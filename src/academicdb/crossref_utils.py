@@ -2,8 +2,87 @@
 functions to access crossref API
 """
 
+from functools import lru_cache
 from crossref.restful import Works
 
+from . import utils
+
+
+@lru_cache(maxsize=4096)
+def format_author_name(family, given):
+    """
+    convert a crossref author name to pubmed format (family name and
+    initials); memoized since the same authors recur across publications
+    """
+    given_split = given.split(' ')
+    if len(given_split) > 1:
+        initials = ''.join([i[0] for i in given_split])
+    else:
+        initials = given_split[0][0]
+    return '%s %s' % (family, initials)
+
+
+# (concurrent requests, requests per second) allowed by crossref for
+# requests that give a contact email (the polite pool) and for the rest
+polite_pool_limits = (3, 10)
+public_pool_limits = (1, 5)
+
+
+def fetch_crossref_batch(
+    dois, mailto=None, batch_size=100, concurrency=None, rate_limit=None
+):
+    """
+    retrieve crossref records for many DOIs at once, using the doi filter
+    of the works endpoint rather than one request per DOI
+
+    parameters:
+    -----------
+    dois: list of DOIs
+    mailto: string, contact email sent with the requests, which puts them
+        in crossref's polite pool
+    batch_size: int, number of DOIs per request (crossref returns at most
+        100 rows per page)
+    concurrency: int, number of requests in flight at once (defaults to
+        the limit of the pool the requests go to)
+    rate_limit: float, maximum number of requests per second (defaults
+        to the limit of the pool the requests go to)
+
+    returns a dict of records keyed by lowercased DOI; DOIs that crossref
+    did not return are absent
+    """
+    pool_concurrency, pool_rate_limit = (
+        polite_pool_limits if mailto else public_pool_limits
+    )
+    # commas separate filter values, so such DOIs cannot be batched
+    dois = [doi for doi in dict.fromkeys(dois) if ',' not in doi]
+    batches = [
+        dois[i : i + batch_size] for i in range(0, len(dois), batch_size)
+    ]
+    records = {}
+    for items in utils.rate_limited_map(
+        lambda batch: _fetch_crossref_page(batch, mailto),
+        batches,
+        concurrency=concurrency or pool_concurrency,
+        rate_limit=rate_limit or pool_rate_limit,
+    ):
+        for item in items:
+            records[item['DOI'].lower()] = item
+    return records
+
+
+def _fetch_crossref_page(dois, mailto=None):
+    params = {
+        'filter': ','.join(f'doi:{doi}' for doi in dois),
+        'rows': len(dois),
+    }
+    if mailto:
+        params['mailto'] = mailto
+    response = utils.get_crossref_session().get(
+        utils.crossref_works_url, params=params, timeout=60
+    )
+    response.raise_for_status()
+    return response.json()['message']['items']
+
 
 def get_crossref_records(dois):
     works = Works()
@@ -104,13 +183,7 @@ def parse_crossref_record(
     for author in record['author']:
         if 'given' not in author or 'family' not in author:
             continue
-        given_split = author['given'].split(' ')
-        if len(given_split) > 1:
-            initials = ''.join([i[0] for i in given_split])
-        else:
-            initials = given_split[0][0]
-        entry = '%s %s' % (author['family'], initials)
-        authors.append(entry)
+        authors.append(format_author_name(author['family'], author['given']))
     pub['authors'] = ', '.join(authors)
     pub['author_records'] = record['author']
 
@@ -192,13 +265,9 @@ def process_crossref_records(
             for author in crossref_records[r]['author']:
                 if 'given' not in author or 'family' not in author:
                     continue
-                given_split = author['given'].split(' ')
-                if len(given_split) > 1:
-                    initials = ''.join([i[0] for i in given_split])
-                else:
-                    initials = given_split[0][0]
-                entry = '%s %s' % (author['family'], initials)
-                authors.append(entry)
+                authors.append(
+                    format_author_name(author['family'], author['given'])
+                )
         if len(authors) > etal_thresh:
             pubs[r]['authors'] = '%s et al.' % authors[0]
         else:
@@ -1,8 +1,27 @@
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 import pymongo
+import pymongo.errors
+from pymongo.write_concern import WriteConcern
 import logging
 
 
+@contextmanager
+def log_write_errors(table: str):
+    """
+    log the records that failed in an unordered bulk write, rather than
+    abandoning the rest of the build; the other writes have been applied
+    """
+    try:
+        yield
+    except pymongo.errors.BulkWriteError as e:
+        for error in e.details.get('writeErrors', []):
+            logging.error(
+                f"could not write record to {table}: {error.get('errmsg')}"
+                f" ({error.get('op')})"
+            )
+
+
 class AbstractDatabase(ABC):
     def __init__(self, **kwargs):
         self.db = None
@@ -49,6 +68,10 @@ class AbstractDatabase(ABC):
     def get_collection(self, collection_name: str, **kwargs):
         pass
 
+    @abstractmethod
+    def iter_collection(self, collection_name: str, **kwargs):
+        pass
+
     @abstractmethod
     def drop_collection(self, collection_name: str, **kwargs):
         pass
@@ -60,6 +83,7 @@ class MongoDatabase(AbstractDatabase):
         dbname: str = 'academicdb',
         connect_string: str = None,
         overwrite: bool = False,
+        fast_writes: bool = False,
         **kwargs,
     ):
         super().__init__(**kwargs)
@@ -67,6 +91,11 @@ class MongoDatabase(AbstractDatabase):
         self.dbname = dbname
         self.overwrite = overwrite
         self.connect_string = connect_string
+        # the database can always be rebuilt, so writes may optionally be
+        # acknowledged before they are journaled or replicated
+        self.write_concern = (
+            WriteConcern(w=1, j=False) if fast_writes else None
+        )
 
         self.connect()
         self.setup_db()
@@ -79,31 +108,31 @@ class MongoDatabase(AbstractDatabase):
             self.client = pymongo.MongoClient(host='127.0.0.1', port=27017)
 
     def setup_db(self, **kwargs):
-        # it exists and overwrite is False, just make sure metadata are ok
-        if (
-            self.dbname in self.client.list_database_names()
-            and not self.overwrite
-        ):
+        # each branch needs only one round trip: counting in a missing
+        # database gives 0 and dropping a missing database does nothing,
+        # so there is no need to list the databases first
+        if not self.overwrite:
             # check to make sure only one metadata record exists
-            if len(list(self.client[self.dbname]['metadata'].find())) > 1:
+            if self.client[self.dbname]['metadata'].count_documents({}) > 1:
                 raise ValueError(
                     'more than one metadata record exists in the database - please rerun with overwrite set to True'
                 )
             logging.info('keeping existing database')
 
         # otherwise clean everything out and start over
-        elif self.dbname in self.client.list_database_names():
+        else:
+            # a single drop removes all of the collections and their
+            # documents on the server, without reading any of them
             logging.info('dropping database')
-            if self.collections is None:
-                for c in self.collections:
-                    self.client[self.dbname].drop_collection(c)
             self.client.drop_database(self.dbname)
 
     def setup_collections(self, **kwargs):
         logging.info('setting up collections')
         result = self.client[self.dbname]
+        # list the existing collections once rather than once per collection
+        existing = set(result.list_collection_names())
         for c in self.collections:
-            if c not in result.list_collection_names():
+            if c not in existing:
                 logging.debug(f'creating collection {c}')
                 result.create_collection(c)
         indices_to_create = {
@@ -113,39 +142,113 @@ class MongoDatabase(AbstractDatabase):
         for c, idx in indices_to_create.items():
             logging.debug(f'creating index {idx} on collection {c}')
             result[c].create_index([(idx, pymongo.ASCENDING)], unique=True)
+        # get_collaborators selects the recent publications by date
+        result['publications'].create_index(
+            [('publication-date', pymongo.ASCENDING)]
+        )
 
     def query(self, query_string: str, **kwargs):
         pass
 
-    def add(self, table: str, content: list, **kwargs):
-        if table not in self.list_collections():
-            self.client[self.dbname].create_collection(table)
+    def add(self, table: str, content: list, batch_size: int = 500, **kwargs):
+        # mongo creates the collection on the first write, so it only
+        # needs to be created explicitly when there is nothing to write
+        if not content:
+            if table not in self.list_collections():
+                self.client[self.dbname].create_collection(table)
+            return
+
+        collection = self.client[self.dbname].get_collection(
+            table, write_concern=self.write_concern
+        )
+        if table == 'metadata':
+            # there is only one metadata record, so the old one is removed
+            # and the new one inserted in a single ordered request, rather
+            # than adding another copy on each run
+            with log_write_errors(table):
+                collection.bulk_write(
+                    [pymongo.DeleteMany({})]
+                    + [pymongo.InsertOne({'$set': c}) for c in content],
+                    ordered=True,
+                )
+            return
+
+        if table != 'publications':
+            # plain inserts are streamed straight to the server; the driver
+            # splits them into as few messages as the server allows
+            with log_write_errors(table):
+                collection.insert_many(
+                    ({'$set': c} for c in content), ordered=False
+                )
+            return
 
+        # publications are upserted on DOI in batches, one round trip per
+        # batch. the writes in a batch are independent, so they are sent
+        # unordered and the server can apply them in parallel
+        batch = []
+        batch_dois = set()
         for c in content:
-            if table == 'publications':
-                if c and 'DOI' in c:
-                    self.client[self.dbname][table].update_one(
-                        {'DOI': c['DOI']}, {'$set': c}, upsert=True
-                    )
-                else:
-                    logging.warning(f'no DOI found in publication: {c}')
-            else:
-                self.client[self.dbname][table].insert_one({'$set': c})
+            if not c or 'DOI' not in c:
+                logging.warning(f'no DOI found in publication: {c}')
+                continue
+            # a repeated DOI depends on the earlier upsert, so write out
+            # the batch before queueing it
+            if c['DOI'] in batch_dois:
+                with log_write_errors(table):
+                    collection.bulk_write(batch, ordered=False)
+                batch = []
+                batch_dois = set()
+            batch_dois.add(c['DOI'])
+            batch.append(
+                pymongo.UpdateOne({'DOI': c['DOI']}, {'$set': c}, upsert=True)
+            )
+            if len(batch) >= batch_size:
+                with log_write_errors(table):
+                    collection.bulk_write(batch, ordered=False)
+                batch = []
+                batch_dois = set()
+        if batch:
+            with log_write_errors(table):
+                collection.bulk_write(batch, ordered=False)
 
     def list_collections(self, **kwargs):
         return self.client[self.dbname].list_collection_names()
 
     def get_collection(self, collection_name: str, **kwargs):
-        # deal with some tables that don't use $set
-        testitem = self.client[self.dbname][collection_name].find_one({})
-        if testitem is not None:
-            if '$set' not in testitem:
-                return list(self.client[self.dbname][collection_name].find({}))
-            else:
-                return [
-                    item['$set']
-                    for item in self.client[self.dbname][collection_name].find({})
-                ]
+        items = list(self.iter_collection(collection_name, **kwargs))
+        if items:
+            return items
+
+    def iter_collection(
+        self,
+        collection_name: str,
+        fields: list = None,
+        query: dict = None,
+        batch_size: int = 500,
+        exclude: list = None,
+        **kwargs,
+    ):
+        """
+        stream the records in a collection that match query (all if None),
+        fetching batch_size records per round trip and only the requested
+        fields (all if None), or all but the excluded fields
+
+        fields, exclude and query apply to top-level fields, so they should
+        only be used for tables whose records are not stored under $set
+        (such as publications)
+        """
+        if fields is not None and exclude is not None:
+            raise ValueError('only one of fields and exclude can be given')
+        projection = None
+        if fields is not None:
+            projection = {field: 1 for field in fields}
+        elif exclude is not None:
+            projection = {field: 0 for field in exclude}
+        cursor = self.client[self.dbname][collection_name].find(
+            query or {}, projection, batch_size=batch_size
+        )
+        for item in cursor:
+            yield item['$set'] if '$set' in item else item
 
     def drop_collection(self, collection_name: str, **kwargs):
         self.client[self.dbname].drop_collection(collection_name)
@@ -175,5 +278,8 @@ class Database:
     def get_collection(self, collection_name: str, **kwargs):
         return self.db.get_collection(collection_name, **kwargs)
 
+    def iter_collection(self, collection_name: str, **kwargs):
+        return self.db.iter_collection(collection_name, **kwargs)
+
     def drop_collection(self, collection_name: str, **kwargs):
         return self.db.drop_collection(collection_name, **kwargs)
@@ -1,10 +1,12 @@
 import argparse
+import copy
 import logging
 import os
+import sys
+from collections import defaultdict
 from academicdb import database, researcher, orcid, utils, publication
 import pandas as pd
 from pybliometrics.scopus import AuthorRetrieval
-import pybliometrics
 
 # setup logging as global
 logging.basicConfig(
@@ -57,13 +59,34 @@ def parse_args():
         help='file with bad ids to remove',
         default='bad_ids.csv',
     )
+    parser.add_argument(
+        '--gscholar',
+        action='store_true',
+        help='get google scholar metrics (not stored in the database)',
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        help='number of scopus records to retrieve in parallel',
+        default=4,
+    )
+    parser.add_argument(
+        '--rate_limit',
+        type=float,
+        help='maximum number of scopus requests per second',
+        default=2,
+    )
+    parser.add_argument(
+        '--fast_writes',
+        action='store_true',
+        help='acknowledge database writes without waiting for the journal'
+        ' or replicas (rerun dbbuilder if the server fails mid-write)',
+    )
     return parser.parse_args()
 
 
 def load_config(configfile):
-    import toml
-
-    return toml.load(configfile)
+    return utils.load_config(configfile)
 
 
 def df_to_dicts(df):
@@ -73,18 +96,21 @@ def df_to_dicts(df):
     return [df.loc[i].to_dict() for i in df.index]
 
 
+# publication class used to format each type of publication
+pub_classes = {
+    'journal-article': publication.JournalArticle,
+    'proceedings-article': publication.JournalArticle,
+    'book-chapter': publication.BookChapter,
+    'book': publication.Book,
+}
+
+
 def add_citations(publications, reftypes=None):
     if reftypes is None:
         reftypes = ['latex', 'md']
 
     for doi, pub in publications.items():
-        pub_func = {
-            'journal-article': publication.JournalArticle,
-            'proceedings-article': publication.JournalArticle,
-            'book-chapter': publication.BookChapter,
-            'book': publication.Book,
-        }
-        pubstruct = pub_func[pub['type']]().from_dict(pub)
+        pubstruct = pub_classes[pub['type']]().from_dict(pub)
         publications[doi]['citation'] = {
             reftype: pubstruct.format_reference(reftype)
             for reftype in reftypes
@@ -92,6 +118,37 @@ def add_citations(publications, reftypes=None):
     return publications
 
 
+additional_info_files = [
+    'editorial.csv',
+    'talks.csv',
+    'conference.csv',
+    'teaching.csv',
+    'funding.csv',
+]
+
+
+def read_additional_info(basedir):
+    """
+    read the optional csv files with additional information in basedir,
+    so that a malformed file is reported before any records are retrieved
+
+    returns a dict mapping each table name to its list of records
+    """
+    info = {}
+    for f in additional_info_files:
+        try:
+            df = pd.read_csv(os.path.join(basedir, f), memory_map=True)
+        except FileNotFoundError:
+            continue
+        logging.info(f'Read additional information from {f}')
+        # convert all rows at once rather than building a Series per row
+        info[f.split('.')[0]] = [
+            utils.remove_nans_from_pub(line_dict)
+            for line_dict in df.to_dict('records')
+        ]
+    return info
+
+
 def drop_empty_pubs(publications):
     empty_pubs = [i for i in publications if publications[i] is None]
     for i in empty_pubs:
@@ -99,20 +156,22 @@ def drop_empty_pubs(publications):
     return publications
 
 
-def setup_db(configfile, overwrite=False):
+def setup_db(configfile, overwrite=False, fast_writes=False):
     logging.info(f'Using database config from {configfile}')
-    config = load_config(configfile)
-    if config is not None and 'mongo' in config and 'CONNECT_STRING' in config['mongo']:
+    config = load_config(configfile) or {}
+    # a missing connect string makes MongoDatabase use localhost
+    connect_string = config.get('mongo', {}).get('CONNECT_STRING')
+    if connect_string is not None:
         logging.info('Using custom mongodb config')
-        return database.Database(
-            database.MongoDatabase(
-                overwrite=overwrite,
-                connect_string=config['mongo']['CONNECT_STRING'],
-            )
-        )
-    logging.info('Using default localhost database config')
+    else:
+        logging.info('Using default localhost database config')
     return database.Database(
-        database.MongoDatabase(overwrite=overwrite))
+        database.MongoDatabase(
+            overwrite=overwrite,
+            connect_string=connect_string,
+            fast_writes=fast_writes,
+        )
+    )
 
 
 def get_affiliation(aff):
@@ -192,18 +251,29 @@ def main():
             f'You must first set up the config.toml file in {args.configdir}'
         )
 
-    pybliometrics.scopus.init()
+    additional_info = (
+        {} if args.no_add_info else read_additional_info(args.basedir)
+    )
+
+    utils.init_scopus()
+    utils.share_scopus_session(pool_size=args.concurrency)
 
-    db = setup_db(configfile, args.overwrite)
+    db = setup_db(configfile, args.overwrite, fast_writes=args.fast_writes)
 
     r = researcher.Researcher(configfile)
     r.get_orcid_data()
-    r.get_google_scholar_data()
+    # google scholar scraping is slow and its results are not used downstream
+    if args.gscholar:
+        r.get_google_scholar_data()
 
     if not args.no_add_pubs:
         logging.info('Getting publications')
         maxret = 5 if args.test else None
-        r.get_publications(maxret=maxret)
+        r.get_publications(
+            maxret=maxret,
+            concurrency=args.concurrency,
+            rate_limit=args.rate_limit,
+        )
         print(f'Found {len(r.publications)} publications')
 
         additional_pubs_file = os.path.join(
@@ -216,7 +286,21 @@ def main():
             )
     else:
         logging.warning('Loading pubs from database')
-        r.publications = db.get_collection('publications')
+        # key the stored publications by DOI, as get_publications does, so
+        # that they are updated in place and written back in one batched
+        # upsert by to_database
+        # the large fields that are not used below are left in the
+        # database; writing back with $set does not remove them
+        r.publications = {}
+        for pub in db.iter_collection(
+            'publications',
+            exclude=['abstract', 'author_records', 'author_ids', 'affiliation_ids'],
+        ):
+            pub.pop('_id', None)
+            r.publications[pub['DOI']] = pub
+        # keep a copy of the stored records, so that only the publications
+        # that are changed below need to be written back
+        stored_pubs = copy.deepcopy(r.publications)
 
     # drop bad dois
     bad_ids_file = (
@@ -226,13 +310,17 @@ def main():
     )
 
     if os.path.exists(bad_ids_file):
-        bad_ids = pd.read_csv(bad_ids_file)
-        # get list of all pmids for checking
+        bad_ids = pd.read_csv(bad_ids_file, memory_map=True)
+        # index the publications by pmid once, for checking
         logging.info(f'Dropping excluded publications')
-        all_pmids = [str(pub['PMID']) for pub in r.publications.values() if pub is not None and 'PMID' in pub and pub['PMID'] is not None]
-        for idx in bad_ids.index:
-            id = bad_ids.loc[idx, 'idval'].strip()
-            idtype = bad_ids.loc[idx, 'idtype'].strip()
+        pmid_index = defaultdict(list)
+        for key, pub in r.publications.items():
+            if pub is not None and 'PMID' in pub and pub['PMID'] is not None:
+                pmid_index[str(pub['PMID'])].append(key)
+        # walk the two columns directly rather than indexing each row
+        for id, idtype in zip(bad_ids['idval'], bad_ids['idtype']):
+            id = id.strip()
+            idtype = idtype.strip()
             if idtype == 'doi':
                 if id in r.publications:
                     del r.publications[id]
@@ -240,38 +328,25 @@ def main():
                 else:
                     logging.warning(f'Excluded doi {id} not found')
             elif idtype == 'pmid':
-                if id in all_pmids:
-                    del_id = [k for k, v in r.publications.items() if v is not None and 'PMID' in v and str(v['PMID']) == id]
-                    if len(del_id) > 0:
-                        del r.publications[del_id[0]]
+                if id in pmid_index:
+                    keys = pmid_index[id]
+                    if keys:
+                        r.publications.pop(keys.pop(0), None)
                         logging.info(f'Dropping excluded publication {id}')
                 else:
                     logging.warning(f'Excluded pmid {id} not found')
-       
+
     r.publications = drop_empty_pubs(r.publications)
 
     if not args.no_add_info:
-        additional_files = [
-            'editorial.csv',
-            'talks.csv',
-            'conference.csv',
-            'teaching.csv',
-            'funding.csv',
-        ]
+        for target, items in additional_info.items():
+            logging.info(f'Adding information from {target}.csv')
+            # write all rows at once rather than flushing once per row
+            if items:
+                sys.stdout.write('\n'.join(str(i) for i in items) + '\n')
+                sys.stdout.flush()
 
-        for f in additional_files:
-            additional_file = os.path.join(args.basedir, f)
-            target = f.split('.')[0]
-            if os.path.exists(additional_file):
-                items = []
-                logging.info(f'Adding information from {f}')
-                df = pd.read_csv(additional_file)
-                for i in df.index:
-                    line_dict = utils.remove_nans_from_pub(df.loc[i].to_dict())
-                    print(line_dict)
-                    items.append(line_dict)
-
-                setattr(r, target, items)
+            setattr(r, target, items)
 
         education_df = orcid.get_orcid_education(r.orcid_data)
         setattr(r, 'education', df_to_dicts(education_df))
@@ -295,7 +370,16 @@ def main():
 
     r.publications = add_citations(r.publications)
 
-    r.get_coauthors()
+    r.get_coauthors(concurrency=args.concurrency, rate_limit=args.rate_limit)
 
     if not args.nodb:
+        if args.no_add_pubs:
+            r.publications = {
+                doi: pub
+                for doi, pub in r.publications.items()
+                if stored_pubs.get(doi) != pub
+            }
+            logging.info(
+                f'{len(r.publications)} stored publications were updated'
+            )
         r.to_database(db)
@@ -17,6 +17,11 @@ from pybliometrics.scopus import AuthorRetrieval
 from academicdb.dbbuilder import get_affiliation
 import datetime
 from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+import re
+import string
+import unicodedata
 
 
 def parse_args():
@@ -40,9 +45,46 @@ def parse_args():
         help='number of years back to include',
         default=4
     )
+    parser.add_argument(
+        '-q', '--quiet',
+        action='store_true',
+        help='do not print per-coauthor progress messages'
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        help='number of scopus author records to fetch in parallel',
+        default=4
+    )
+    parser.add_argument(
+        '--rate_limit',
+        type=float,
+        help='maximum number of scopus requests per second',
+        default=2
+    )
+    parser.add_argument(
+        '--match_initials',
+        action='store_true',
+        help='also merge non-scopus coauthors into the scopus coauthor with '
+        'the same surname and compatible initials (e.g. Smith J and Smith JA)'
+    )
     return parser.parse_args()
 
 
+@dataclass(slots=True)
+class Coauthor:
+    """coauthor record used while matching; converted to a dict for output"""
+    pubtype: str
+    scopus_id: str | None
+    name: str
+    affiliation: list | None
+    affiliation_id: list | None
+    date: str | None
+    year: int | None
+    name_abbrev: str | None = None
+    name_hash: int | None = None
+
+
 def process_coauthors(coauthors):
     """Process coauthors into a dataframe"""
     coauthors_df = pd.DataFrame(coauthors)
@@ -50,33 +92,71 @@ def process_coauthors(coauthors):
     coauthors_df = coauthors_df.sort_values('n_pubs', ascending=False)
     return coauthors_df
 
-def get_scopus_coauthors(pub):
+@lru_cache(maxsize=None)
+def get_author_record(scopus_id):
+    """
+    retrieve a scopus author record, once per run for each author
+    (pybliometrics keeps its own on-disk cache across runs)
+    """
+    return AuthorRetrieval(scopus_id, view=utils.author_view)
+
+
+def prefetch_author_records(scopus_ids, concurrency=1):
+    """fetch the scopus records for a set of authors in parallel"""
+    for _ in utils.rate_limited_map(
+        get_author_record, scopus_ids, concurrency=concurrency
+    ):
+        pass
+
+
+@lru_cache(maxsize=None)
+def get_author_summary(scopus_id):
+    """
+    get the name and current affiliations of a scopus author, once per
+    run for each author rather than once per shared publication
+
+    returns None for authors that should not be listed
+    """
+    coauthor_info = get_author_record(scopus_id)
+    if coauthor_info.indexed_name is None or 'Poldrack' in coauthor_info.indexed_name:
+        return None
+    if coauthor_info.affiliation_current is None:
+        affil = None
+        affil_id = None
+    else:
+        affil = [
+            get_affiliation(aff)
+            for aff in coauthor_info.affiliation_current
+        ]
+        affil_id = [
+            aff.id for aff in coauthor_info.affiliation_current
+        ]
+    name = f'{coauthor_info.surname}, {coauthor_info.given_name} '
+    return name, affil, affil_id
+
+
+def get_scopus_coauthors(pub, self_ids=frozenset()):
     # print(f'processing scopus pub', pub['DOI'])
     coauthors = {}
+    date = pub['publication-date']
+    year = int(date.split('-')[0])
     for coauthor in pub['scopus_coauthor_ids']:
-        coauthor_info = AuthorRetrieval(coauthor)
-        if coauthor_info.indexed_name is None or 'Poldrack' in coauthor_info.indexed_name:
+        # skip the researcher's own ids without retrieving their record
+        if coauthor in self_ids:
             continue
-        if coauthor_info.affiliation_current is None:
-            affil = None
-            affil_id = None
-        else:
-            affil = [
-                get_affiliation(aff)
-                for aff in coauthor_info.affiliation_current
-            ]
-            affil_id = [
-                aff.id for aff in coauthor_info.affiliation_current
-            ]
-        coauthors[coauthor] = {
-            'pubtype': 'scopus',
-            'scopus_id': coauthor,
-            'name': f'{coauthor_info.surname}, {coauthor_info.given_name} ',
-            'affiliation': affil,
-            'affiliation_id': affil_id,
-            'date': pub['publication-date'],
-            'year': int(pub['publication-date'].split('-')[0]),
-        }
+        summary = get_author_summary(coauthor)
+        if summary is None:
+            continue
+        name, affil, affil_id = summary
+        coauthors[coauthor] = Coauthor(
+            pubtype='scopus',
+            scopus_id=coauthor,
+            name=name,
+            affiliation=affil,
+            affiliation_id=affil_id,
+            date=date,
+            year=year,
+        )
     return coauthors
 
 
@@ -85,26 +165,28 @@ def get_generic_coauthors(pub):
     coauthors = {}
     if 'authors_abbrev' not in pub:
         return None
+    # the date is the same for every author of the publication
+    if 'publication-date' in pub:
+        date = pub['publication-date']
+    elif 'coverDate' in pub:
+        date = utils.get_valid_date(pub)
+    else:
+        print('invalid date:', pub)
+        date = None
+    year = int(date.split('-')[0]) if date is not None else None
     for coauthor in pub['authors_abbrev']:
         if 'Poldrack' in coauthor:
             continue
         namehash = hash(coauthor)
-        if 'publication-date' in pub:
-            date = pub['publication-date']
-        elif 'coverDate' in pub:
-            date = utils.get_valid_date(pub)
-        else:
-            print('invalid date:', pub)
-            date = None
-        coauthors[namehash] = {
-            'pubtype': 'generic',
-            'scopus_id': None,
-            'name': ', '.join(coauthor.split(' ')),
-            'affiliation': None,
-            'affiliation_id': None,
-            'date': date,
-            'year': int(date.split('-')[0]),
-        }
+        coauthors[namehash] = Coauthor(
+            pubtype='generic',
+            scopus_id=None,
+            name=', '.join(coauthor.split(' ')),
+            affiliation=None,
+            affiliation_id=None,
+            date=date,
+            year=year,
+        )
     return coauthors
 
 
@@ -117,31 +199,57 @@ def abbreviate_name(name):
 
 def add_pub_coauthors(coauthors, pub_coauthors):
     for coauthor, coauthor_info in pub_coauthors.items():
-        coauthor_info['name'] = coauthor_info['name'].rstrip().lstrip()
-        if coauthor_info['scopus_id'] is not None:
-            coauthor_info['name_abbrev'] = abbreviate_name(coauthor_info['name'])
-            coauthor_info['name_hash'] = hash(coauthor_info['name_abbrev'])
         if coauthor not in coauthors:
+            # the name forms only need to be computed the first time a
+            # coauthor is seen; later records only update the date
+            coauthor_info.name = coauthor_info.name.strip()
+            if coauthor_info.scopus_id is not None:
+                coauthor_info.name_abbrev = abbreviate_name(coauthor_info.name)
+                coauthor_info.name_hash = hash(coauthor_info.name_abbrev)
             coauthors[coauthor] = coauthor_info
         else:
             try:
-                datetime = pd.to_datetime(coauthor_info['date'])
+                datetime = pd.to_datetime(coauthor_info.date)
             except:
-                date = f'{pub["year"]}-01-01'
+                date = f'{coauthor_info.year}-01-01'
                 datetime = pd.to_datetime(date)
-            if datetime > pd.to_datetime(coauthors[coauthor]['date']):
-                coauthors[coauthor]['date'] = datetime.strftime("%Y-%m-%d")
+            if datetime > pd.to_datetime(coauthors[coauthor].date):
+                coauthors[coauthor].date = datetime.strftime("%Y-%m-%d")
     return coauthors
 
+def _noop(*args, **kwargs):
+    pass
+
+
 # refactoring
-def get_coauthors(publications, verbose=True):
+def get_coauthors(
+    publications, verbose=True, concurrency=1, self_ids=frozenset()
+):
+    """
+    get the coauthors from a set of publications
+
+    self_ids is a set of the researcher's own scopus ids, which are
+    skipped rather than retrieved as coauthors
+    """
+    publications = list(publications)
+    # fetch every scopus coauthor up front so that the requests can run
+    # in parallel, rather than one at a time within each publication
+    scopus_ids = {
+        coauthor
+        for pub in publications
+        if utils.has_scopus_coauthor_ids(pub)
+        for coauthor in pub['scopus_coauthor_ids']
+        if coauthor not in self_ids
+    }
+    prefetch_author_records(scopus_ids, concurrency=concurrency)
+
     coauthors = {}
     for pub in publications: 
         # figure out which type of author record there is
 
-        if 'scopus_coauthor_ids' in pub:
+        if utils.has_scopus_coauthor_ids(pub):
             pubtype = 'scopus'
-            pub_coauthors = get_scopus_coauthors(pub)
+            pub_coauthors = get_scopus_coauthors(pub, self_ids)
             coauthors = add_pub_coauthors(coauthors, pub_coauthors)
         else:
             pubtype = 'generic'
@@ -152,49 +260,119 @@ def get_coauthors(publications, verbose=True):
     return coauthors
 
 
+# translation table used to drop punctuation in a single pass
+_DROP_PUNCTUATION = str.maketrans('', '', string.punctuation)
+_WHITESPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=4096)
+def normalize_name(name):
+    """
+    strip diacritics and punctuation and collapse whitespace so that
+    name variants compare equal
+    """
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    return _WHITESPACE.sub(' ', name.translate(_DROP_PUNCTUATION)).strip().lower()
+
+
 def find_coauthor_by_name(coauthors, name_abbrev):
-    coauthors = {coauthor: coauthor_info for coauthor, coauthor_info in coauthors.items() if coauthor_info['pubtype'] == 'scopus'}
-    match = [coauthor for coauthor, coauthor_info in coauthors.items() if coauthor_info['name_abbrev'] == name_abbrev]
+    coauthors = {coauthor: coauthor_info for coauthor, coauthor_info in coauthors.items() if coauthor_info.pubtype == 'scopus'}
+    match = [coauthor for coauthor, coauthor_info in coauthors.items() if coauthor_info.name_abbrev == name_abbrev]
     if len(match) == 0:
         return None
     else:
         return match[0]
     
 
-def combine_coauthors(coauthors):
+def initials_compatible(initials, other):
+    """check whether one set of initials is a prefix of the other (J and JA)"""
+    return initials.startswith(other) or other.startswith(initials)
+
+
+def combine_coauthors(coauthors, verbose=True, match_initials=False):
+    """
+    merge coauthors that only have a name (from non-scopus records)
+    into the matching scopus coauthors
+
+    names are matched exactly after normalization; with match_initials,
+    unmatched names are also merged into the one scopus coauthor with the
+    same surname and compatible initials (e.g. Smith J and Smith JA), and
+    left unmerged if there is more than one
+    """
+    # bind the writer once rather than testing verbose per coauthor
+    write = print if verbose else _noop
     # first get scopus coauthors
     scopus_coauthors = {}
     skipped_authors = []
     for coauthor, coauthor_info in coauthors.items():
-        if coauthor_info['pubtype'] == 'scopus':
+        if coauthor_info.pubtype == 'scopus':
             scopus_coauthors[coauthor] = coauthor_info
     # then get generic coauthors
     generic_coauthors = {}
     for coauthor, coauthor_info in coauthors.items():
-        if coauthor_info['pubtype'] == 'generic':
-            print('adding generic coauthor', coauthor)
+        if coauthor_info.pubtype == 'generic':
+            write('adding generic coauthor', coauthor)
             generic_coauthors[coauthor] = coauthor_info
     assert len(scopus_coauthors) + len(generic_coauthors) == len(coauthors)
 
-    # integrate generic coauthors into scopus coauthors
-    scopus_names = [coauthor_info['name_abbrev'] for coauthor_info in scopus_coauthors.values()]
+    # integrate generic coauthors into scopus coauthors, using an index
+    # on the abbreviated name (first scopus match wins) instead of
+    # scanning all scopus coauthors for each generic one
+    scopus_index = {}
+    surname_index = defaultdict(list)
+    for coauthor, coauthor_info in scopus_coauthors.items():
+        name_abbrev = normalize_name(coauthor_info.name_abbrev)
+        scopus_index.setdefault(name_abbrev, coauthor)
+        surname, _, initials = name_abbrev.rpartition(' ')
+        surname_index[surname].append((initials, coauthor))
     for coauthor, coauthor_info in generic_coauthors.items():
-        name_abbrev = coauthor_info['name'].replace(', ', ' ')
-        if name_abbrev not in scopus_names:
+        name_abbrev = normalize_name(coauthor_info.name)
+        scopus_coauthor = scopus_index.get(name_abbrev)
+        surname, _, initials = name_abbrev.rpartition(' ')
+        if scopus_coauthor is None and match_initials and surname:
+            # leaving out a collaborator is worse than listing one twice,
+            # so only an unambiguous match is merged
+            matches = {
+                scopus_id
+                for scopus_initials, scopus_id in surname_index[surname]
+                if initials_compatible(initials, scopus_initials)
+            }
+            if len(matches) == 1:
+                scopus_coauthor = matches.pop()
+                write('matched coauthor', name_abbrev, 'by initials to',
+                      scopus_coauthors[scopus_coauthor].name_abbrev)
+        if scopus_coauthor is None:
             scopus_coauthors[str(coauthor)] = coauthor_info
         else:
-            # print('checking generic coauthor', coauthor, coauthor_info['name'])
-            scopus_coauthor = find_coauthor_by_name(scopus_coauthors, name_abbrev)
-            if scopus_coauthor is None:
-                print('could not find coauthor by name', name_abbrev)
-                skipped_authors.append(name_abbrev)
-            else:
-                datetime = pd.to_datetime(coauthor_info['date'])
-                if datetime > pd.to_datetime(coauthors[scopus_coauthor]['date']):
-                    coauthors[scopus_coauthor]['date'] = datetime.strftime("%Y-%m-%d")
-                 
+            datetime = pd.to_datetime(coauthor_info.date)
+            if datetime > pd.to_datetime(coauthors[scopus_coauthor].date):
+                coauthors[scopus_coauthor].date = datetime.strftime("%Y-%m-%d")
+
     return scopus_coauthors, skipped_authors
 
+def coauthors_to_df(coauthors, nyears=4):
+    """
+    convert coauthor records to the rows of the NSF collaborator table,
+    keeping those with a collaboration in the last nyears years
+    """
+    # only the fields that end up in the table are copied out of each record
+    fields = ('name', 'affiliation', 'date')
+    coauthor_df = pd.DataFrame(
+        [{f: getattr(c, f) for f in fields} for c in coauthors.values()]
+    ).sort_values('name')
+    coauthor_df['dt'] = pd.to_datetime(coauthor_df['date'])
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=365 * nyears)
+    coauthor_df = coauthor_df[coauthor_df['dt'] > cutoff].copy()
+    coauthor_df['date'] = coauthor_df['dt'].dt.strftime("%m/%d/%Y")
+    del coauthor_df['dt']
+    coauthor_df['email'] = ''
+    coauthor_df['type'] = 'A:'
+    coauthor_df = coauthor_df[['type', 'name', 'affiliation', 'email', 'date']]
+    # first listed affiliation, column-wise rather than per row
+    coauthor_df['affiliation'] = coauthor_df['affiliation'].str[0].fillna('')
+    return coauthor_df
+
+
 def get_coauthors_prev(publications, verbose=True):
 
     coauthors = {}
@@ -260,25 +438,52 @@ if __name__ == "__main__":
             f'You must first set up the config.toml file in {args.configdir}'
         )
     db = setup_db(configfile)
+    utils.init_scopus()
+    # the limiter is applied by the shared session to requests that go out
+    # over the network, as in dbbuilder
+    utils.share_scopus_session(
+        pool_size=args.concurrency,
+        limiter=utils.ScopusRateLimiter(args.rate_limit),
+    )
+    config = load_config(configfile)
+    scopus_id = config['researcher'].get('scopus_id')
+    self_ids = frozenset([str(scopus_id)]) if scopus_id else frozenset()
+
+    # stream only the fields needed to find coauthors, and only from
+    # publications recent enough to be reported; the iso date strings
+    # compare in date order (records without a date are checked locally)
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=365 * args.nyears)
+    publications = db.iter_collection(
+        'publications',
+        fields=[
+            'DOI',
+            'scopus_coauthor_ids',
+            'authors_abbrev',
+            'publication-date',
+            'coverDate',
+            'year',
+        ],
+        query={
+            '$or': [
+                {'publication-date': {'$gte': cutoff.strftime('%Y-%m-%d')}},
+                {'publication-date': {'$exists': False}},
+            ]
+        },
+    )
 
-    publications = db.get_collection('publications')
-
-    coauthors = get_coauthors(publications)
-    coauthors, skipped_authors = combine_coauthors(coauthors)
+    coauthors = get_coauthors(
+        publications,
+        verbose=not args.quiet,
+        concurrency=args.concurrency,
+        self_ids=self_ids,
+    )
+    coauthors, skipped_authors = combine_coauthors(
+        coauthors, verbose=not args.quiet, match_initials=args.match_initials
+    )
     print(f'Found {len(coauthors)} total coauthors')
 
     if True:
-        coauthor_df = pd.DataFrame(coauthors).T.sort_values('name')
-        coauthor_df = coauthor_df[['name', 'affiliation', 'date', 'year']]
-        coauthor_df['dt'] = pd.to_datetime(coauthor_df['date'])
-        coauthor_df = coauthor_df.query(f'dt > "{datetime.datetime.now() - datetime.timedelta(days=365*args.nyears)}"')
-        coauthor_df['date'] = coauthor_df['dt'].apply(lambda x: x.strftime("%m/%d/%Y"))
-        del coauthor_df['dt']
-        del coauthor_df['year']
-        coauthor_df['email'] = ''
-        coauthor_df['type'] = 'A:'
-        coauthor_df = coauthor_df[['type', 'name', 'affiliation', 'email', 'date']]
-        coauthor_df['affiliation'] = coauthor_df['affiliation'].apply(lambda x: x[0] if x is not None else '')
+        coauthor_df = coauthors_to_df(coauthors, args.nyears)
         coauthor_df.to_csv(os.path.join(args.outdir, f'{args.outfile}.csv'), index=False)
         print(f'Wrote {len(coauthor_df)} coauthors to {args.outdir}/{args.outfile}.csv')
 
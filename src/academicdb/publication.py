@@ -28,8 +28,9 @@ class Publication:
             ).hexdigest()
 
     def from_dict(self, pubdict):
-        for k, v in pubdict.items():
-            setattr(self, k, v)
+        # none of the fields are properties, so they can be copied into
+        # the instance dict in one step rather than set one at a time
+        self.__dict__.update(pubdict)
         return self
 
 
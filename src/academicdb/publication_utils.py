@@ -21,21 +21,19 @@ def serialize_pubs_to_json(pubs, outfile):
             print('WARNING: hash collision')
             p.hash = p.hash + utils.get_random_hash(4)
         pubdict[p.hash] = vars(p)
-    with open(outfile, 'w') as f:
-        json.dump(pubdict, f)
+    utils.dump_json(pubdict, outfile)
     return pubdict
 
 
 def shorten_authorlist(authors, maxlen=10, n_to_show=3):
-    authors_split = [i.lstrip().rstrip() for i in authors.split(',')]
-    if len(authors_split) > maxlen:
-        return ', '.join(authors_split[:n_to_show]) + ' et al.'
+    # for long lists only split off the authors that are shown, rather
+    # than building a copy of the whole (possibly very long) list
+    if authors.count(',') + 1 > maxlen:
+        shown = authors.split(',', n_to_show)[:n_to_show]
+        return ', '.join(i.strip() for i in shown) + ' et al.'
     else:
-        return ', '.join(authors_split)
+        return ', '.join(i.strip() for i in authors.split(','))
 
 
 def load_pubs_from_json(infile):
-    pubdict = {}
-    with open(infile) as f:
-        pubdict = json.load(f)
-    return pubdict
+    return utils.load_json(infile)
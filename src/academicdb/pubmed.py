@@ -4,25 +4,28 @@ functions to work with pubmed data
 
 from Bio import Entrez
 from datetime import datetime
+from . import utils
 
 def get_pubmed_data(query, email, retmax=1000):
-    Entrez.email = email
+    utils.init_entrez(email)
     print(f'using {email} for Entrez service')
     print('searching for', query)
-    handle = Entrez.esearch(db='pubmed', retmax=retmax, term=query)
-    record = Entrez.read(handle)
-    handle.close()
+    record = Entrez.read(
+        utils.eutils_request('esearch', db='pubmed', retmax=retmax, term=query)
+    )
     pmids = [int(i) for i in record['IdList']]
     print('found %d matches' % len(pmids))
 
     # load full records
-    handle = Entrez.efetch(
-        db='pubmed',
-        id=','.join(['%d' % i for i in pmids]),
-        retmax=retmax,
-        retmode='xml',
+    return Entrez.read(
+        utils.eutils_request(
+            'efetch',
+            db='pubmed',
+            id=','.join(['%d' % i for i in pmids]),
+            retmax=retmax,
+            retmode='xml',
+        )
     )
-    return Entrez.read(handle)
 
 
 def parse_pubmed_pubs(pubmed_records):
@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
 from Bio import Entrez
 from pybliometrics.scopus import AuthorRetrieval
-import pybliometrics
+from . import utils
 
 # tomllib is included in standard library in Python 3.11+
 try:
@@ -30,26 +30,52 @@ class PubmedQuery(AbstractQuery):
     def __init__(self, email, **kwargs):
         super().__init__(**kwargs)
         # an email address is required for Entrez queries
-        Entrez.email = email
-
-    def query(self, query_string, max_results=1000):
-        with Entrez.esearch(
-            db='pubmed', term=query_string, retmax=max_results
-        ) as handle:
-            record = Entrez.read(handle)
-
-        id_list = record['IdList']
-        if not id_list:
+        utils.init_entrez(email)
+
+    def query(
+        self, query_string, max_results=1000, batch_size=200, concurrency=3
+    ):
+        # keep the matching ids on the Entrez history server, so that the
+        # records can be fetched in batches without sending the ids back
+        record = Entrez.read(
+            utils.eutils_request(
+                'esearch',
+                db='pubmed',
+                term=query_string,
+                retmax=max_results,
+                usehistory='y',
+            )
+        )
+
+        n_records = min(int(record['Count']), max_results)
+        if n_records == 0:
             return None
 
-        with Entrez.efetch(
-            db='pubmed', id=id_list, rettype='medline', retmode='xml'
-        ) as handle:
-            records = Entrez.read(handle)
-
+        def fetch_batch(start):
+            return Entrez.read(
+                utils.eutils_request(
+                    'efetch',
+                    db='pubmed',
+                    rettype='medline',
+                    retmode='xml',
+                    retstart=start,
+                    retmax=min(batch_size, n_records - start),
+                    WebEnv=record['WebEnv'],
+                    query_key=record['QueryKey'],
+                )
+            )
+
+        # the batches are fetched concurrently, at the rate NCBI allows
+        # (higher with an api key; see utils.init_entrez)
         records_list = []
-        for recordtype, records in records.items():
-            records_list += list(records)
+        for fetched in utils.rate_limited_map(
+            fetch_batch,
+            range(0, n_records, batch_size),
+            concurrency=concurrency,
+            rate_limit=utils.entrez_rate_limit(),
+        ):
+            for recordtype, records in fetched.items():
+                records_list += list(records)
 
         return records_list
 
@@ -58,7 +84,7 @@ class ScopusQuery(AbstractQuery):
     """ """
 
     def __init__(self, **kwargs):
-        pybliometrics.scopus.init()
+        utils.init_scopus()
         super().__init__(**kwargs)
 
     def query(self, query_string):
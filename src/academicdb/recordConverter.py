@@ -35,13 +35,17 @@ class PubmedRecordConverter(AbstractRecordConverter):
 class ScopusRecordConverter(AbstractRecordConverter):
     """ """
 
-    def __init__(self, record, email):
+    def __init__(self, record, email, crossref_record=None):
         super().__init__(record)
         self.email = email
+        # crossref record already retrieved in a batch, if any
+        self.crossref_record = crossref_record
 
     def convert(self):
         """ """
-        if self.record.doi is not None:
+        if self.crossref_record is not None:
+            crossref_record = self.crossref_record
+        elif self.record.doi is not None:
             crossref_record = Works().doi(self.record.doi)
         else:
             logging.error('No DOI found for Scopus record')
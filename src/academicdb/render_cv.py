@@ -4,12 +4,16 @@ from academicdb.utils import (
     remove_nans_from_pub,
     escape_characters_for_latex,
     load_config,
-    run_shell_cmd,
+    unrendered_publication_fields,
+    group_publications_by_year,
+    rendered_publication_query,
 )
 from academicdb.dbbuilder import setup_db
 import logging
 import argparse
 import os
+import subprocess
+import time
 from academicdb import database
 import pkgutil
 
@@ -271,7 +275,6 @@ def format_publication(pub, debug=False):
 
 
 def get_publications(publications, exclude_dois=None):
-    years = get_publication_years(publications)
     output = ''
     if publications:
         output += """
@@ -279,9 +282,7 @@ def get_publications(publications, exclude_dois=None):
 \\noindent
 """
 
-    for year in years:
-        year_pubs = [i for i in publications if i['year'] == year]
-        year_pubs.sort(key=lambda x: x['authors'])
+    for year, year_pubs in group_publications_by_year(publications).items():
         # list(db['publications'].find({'year': {'$regex': f'^{year}'}}).sort("firstauthor", pymongo.ASCENDING))
         output += f'\\subsection*{{{year}}}'
         for pub in year_pubs:
@@ -413,7 +414,13 @@ def main():
     doc += get_teaching(db.get_collection('teaching'))
 
     doc += get_publications(
-        db.get_collection('publications'),
+        list(
+            db.iter_collection(
+                'publications',
+                query=rendered_publication_query,
+                exclude=unrendered_publication_fields,
+            )
+        ),
     )
 
     doc += get_conferences(db.get_collection('conference'))
@@ -431,16 +438,20 @@ def main():
 
     # render latex
     if not args.no_render:
-        result = run_shell_cmd(
-            f'xelatex -halt-on-error {args.outfile}.tex',
+        # xelatex writes its log straight to the terminal rather than
+        # through a pipe; success is judged from the exit status and a
+        # freshly written pdf
+        pdffile = os.path.join(args.outdir, f'{args.outfile}.pdf')
+        start_time = time.time()
+        result = subprocess.run(
+            ['xelatex', '-halt-on-error', f'{args.outfile}.tex'],
             cwd=args.outdir,
         )
-        success = False
-        for line in result:
-            if hasattr(line, 'decode') and (
-                line.decode().find('Output written on') > -1
-            ):
-                success = True
+        success = (
+            result.returncode == 0
+            and os.path.exists(pdffile)
+            and os.path.getmtime(pdffile) >= start_time - 1
+        )
         if not success:
             raise RuntimeError('Latex failed to compile')
         else:
@@ -2,7 +2,12 @@
 
 from contextlib import suppress
 from academicdb.dbbuilder import setup_db
-from academicdb.utils import escape_characters_for_latex
+from academicdb.utils import (
+    escape_characters_for_latex,
+    unrendered_publication_fields,
+    group_publications_by_year,
+    rendered_publication_query,
+)
 import logging
 import argparse
 import os
@@ -83,12 +88,9 @@ def format_publication(pub, debug=False):
 
 
 def get_publications(publications, exclude_dois=None):
-    years = get_publication_years(publications)
     output = ''
 
-    for year in years:
-        year_pubs = [i for i in publications if i['year'] == year]
-        year_pubs.sort(key=lambda x: x['authors'])
+    for year, year_pubs in group_publications_by_year(publications).items():
         # list(db['publications'].find({'year': {'$regex': f'^{year}'}}).sort("firstauthor", pymongo.ASCENDING))
         output += f'###  {year}\n\n'
         for pub in year_pubs:
@@ -154,7 +156,13 @@ def main():
 
 
     doc = get_publications(
-        db.get_collection('publications'),
+        list(
+            db.iter_collection(
+                'publications',
+                query=rendered_publication_query,
+                exclude=unrendered_publication_fields,
+            )
+        ),
     )
 
 
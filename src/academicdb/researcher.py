@@ -9,9 +9,9 @@ from scholarly import MaxTriesExceededException
 import logging
 import pandas as pd
 from contextlib import suppress
+from collections import defaultdict
 import math
 from pybliometrics.scopus import AuthorRetrieval, ScopusSearch
-import pybliometrics
 from crossref.restful import Works
 
 try:
@@ -19,7 +19,15 @@ try:
 except ModuleNotFoundError:
     import tomli as tomllib
 
-from . import orcid, pubmed, utils, query, recordConverter, database
+from . import (
+    orcid,
+    pubmed,
+    utils,
+    query,
+    recordConverter,
+    database,
+    crossref_utils,
+)
 
 
 researcher_fields = [
@@ -50,6 +58,18 @@ database_fields = [
     'coauthors',
 ]
 
+# scopus aggregation type and subtype for each publication type used
+# in the additional publications file
+pub_types = {
+    'journal-article': ('Journal', 'Article'),
+    'book': ('Book', 'Book'),
+    'book-chapter': ('Book', 'Book Chapter'),
+    'proceedings-article': (
+        'Conference Proceeding',
+        'Conference Paper',
+    ),
+}
+
 
 def get_affiliation(aff):
     if aff.parent_preferred_name is not None:
@@ -58,7 +78,9 @@ def get_affiliation(aff):
         return f'{aff.preferred_name}, {aff.city}, {aff.country}'
 
 
-def process_scopus_record(scopus_record, r):
+def process_scopus_record(
+    scopus_record, r, lookup_pmcid=True, crossref_records=None
+):
     if utils.has_skip_strings(scopus_record.title):
         logging.info(
             f'Skipping record with title: {scopus_record.title}'
@@ -76,8 +98,14 @@ def process_scopus_record(scopus_record, r):
         )
         return None
     try:
+        # use the crossref record from the batch lookup when there is one
+        crossref_record = (
+            crossref_records.get(scopus_record.doi.lower())
+            if crossref_records and scopus_record.doi is not None
+            else None
+        )
         record = recordConverter.ScopusRecordConverter(
-            scopus_record, r.metadata.email
+            scopus_record, r.metadata.email, crossref_record=crossref_record
         ).convert()
         if record is None:
             logging.warning(f'Empty record {doi}')
@@ -105,8 +133,13 @@ def process_scopus_record(scopus_record, r):
 
     # get pmid and pmcid if available
     record['PMID'] = scopus_record.pubmed_id
-    record['PMCID'] = utils.get_pmcid_from_pmid(
-        scopus_record.pubmed_id, email=r.metadata.email
+    # callers that process many records can look up the pmcids in bulk
+    record['PMCID'] = (
+        utils.get_pmcid_from_pmid(
+            scopus_record.pubmed_id, email=r.metadata.email
+        )
+        if lookup_pmcid
+        else None
     )
     
     # fix date format
@@ -115,6 +148,55 @@ def process_scopus_record(scopus_record, r):
 
     return record
 
+
+def prefetch_crossref_records(dois, email=None):
+    """
+    retrieve the crossref records for many dois in a few batched
+    requests, rather than one request per scopus record; the email is
+    sent as the crossref contact address
+
+    returns a dict keyed by lowercased doi, which is empty if the batch
+    lookup fails (the records are then requested one at a time)
+    """
+    try:
+        return crossref_utils.fetch_crossref_batch(
+            [doi for doi in dois if doi is not None], mailto=email
+        )
+    except requests.RequestException as e:
+        logging.warning(f'batch crossref lookup failed: {e}')
+        return {}
+
+
+def search_scopus_by_dois(dois):
+    """
+    search scopus for a batch of dois with a single query
+
+    returns a dict mapping each (lowercased) doi that was found to its
+    scopus search result
+    """
+    scopus_search_result = ScopusSearch(
+        ' OR '.join(f'DOI({doi})' for doi in dois)
+    )
+    found = {}
+    if (
+        scopus_search_result is not None
+        and scopus_search_result.results is not None
+    ):
+        for scopus_record in scopus_search_result.results:
+            if scopus_record.doi is not None:
+                found.setdefault(scopus_record.doi.lower(), scopus_record)
+    return found
+
+
+def copy_pubmed_pmcid(pubmed_pub, pub):
+    """
+    fill in a missing pmcid from the matching pubmed record, in the
+    form stored for scopus records (without the PMC prefix)
+    """
+    if pub is not None and pub.get('PMCID') is None and pubmed_pub.get('PMC'):
+        pub['PMCID'] = pubmed_pub['PMC'].replace('PMC', '')
+
+
 class ResearcherMetadata:
     def __init__(self):
         fields = [
@@ -139,7 +221,7 @@ class ResearcherMetadata:
 
 class Researcher:
     def __init__(self, param_file, basedir=None):
-        pybliometrics.scopus.init()
+        utils.init_scopus()
         self.param_file = param_file
         self.basedir = (
             os.path.dirname(param_file) if basedir is None else basedir
@@ -171,11 +253,7 @@ class Researcher:
     def get_orcid_data(self, timeout=60):
         orcid_url = 'https://pub.orcid.org/v3.0/%s' % self.metadata.orcid
         print('using ORCID URL:', orcid_url)
-        resp = requests.get(
-            orcid_url,
-            headers={'Accept': 'application/vnd.orcid+json'},
-            timeout=timeout,
-        )
+        resp = utils.get_orcid_session().get(orcid_url, timeout=timeout)
         self.orcid_data = resp.json()
         if 'error-code' in self.orcid_data:
             raise ValueError(
@@ -234,7 +312,9 @@ class Researcher:
             del result['references']
             self.crossref_data.append(result)
 
-    def get_publications(self, maxret=None):
+    def get_publications(
+        self, maxret=None, concurrency=1, rate_limit=None, doi_batch_size=25
+    ):
         """
         get publications from scopus/crossref
 
@@ -242,9 +322,21 @@ class Researcher:
         ----------
         maxret : int
             maximum number of publications to return
+        concurrency : int
+            number of records to process in parallel
+        rate_limit : float
+            maximum number of records submitted per second (None for no limit)
+        doi_batch_size : int
+            number of pubmed dois to look up in each scopus search
         """
         self.publications = {}
-        
+        # pace requests from the quota reported by scopus, on top of
+        # the fixed rate limit; the limit is applied by the shared session
+        # to requests that go out over the network, so records served from
+        # the pybliometrics cache are not held back
+        limiter = utils.ScopusRateLimiter(rate_limit)
+        utils.share_scopus_session(pool_size=concurrency, limiter=limiter)
+
         # first look at scopus records
         scopus_records = query.ScopusQuery().author_query(
             self.metadata.scopus_id
@@ -253,52 +345,171 @@ class Researcher:
         if maxret is not None:
             scopus_records = scopus_records[:maxret]
 
+        # look up each DOI only once, even if scopus lists it more than once
+        # (possibly with different case, since dois are case-insensitive)
+        unique_records = {}
         for scopus_record in scopus_records:
-            record = process_scopus_record(scopus_record, self)
-            if record is not None:
-                self.publications[record['DOI']] = record
+            doi = (
+                scopus_record.doi
+                if scopus_record.doi is not None
+                else scopus_record.eid
+            )
+            unique_records.setdefault(
+                doi.lower() if doi is not None else None, scopus_record
+            )
+        scopus_records = list(unique_records.values())
+        crossref_records = prefetch_crossref_records(
+            [scopus_record.doi for scopus_record in scopus_records],
+            email=self.metadata.email,
+        )
 
+        # process records in a worker pool so that network latency
+        # overlaps with the wait imposed by the rate limit
+        for record in utils.rate_limited_map(
+            lambda scopus_record: process_scopus_record(
+                scopus_record,
+                self,
+                lookup_pmcid=False,
+                crossref_records=crossref_records,
+            ),
+            scopus_records,
+            concurrency=concurrency,
+        ):
+            self._add_publication(record)
 
         # check for additional pubmed dois that are not on scopus
         logging.info('checking for additional pubmed dois')
         pubmed_recs = query.PubmedQuery(self.metadata.email).query(
             self.metadata.query
         )
+        if pubmed_recs is None:
+            self._add_pmcids()
+            return
+        # dois are case-insensitive, so compare them in lower case to avoid
+        # searching scopus again for a publication that is already present
+        known_dois = {
+            doi.lower(): doi for doi in self.publications if doi is not None
+        }
+        pubmed_pubs = {}
         for rec in pubmed_recs:
-            if maxret is not None and len(self.publications) >= maxret:
-                break
             p = recordConverter.PubmedRecordConverter(rec).convert()
-            if p['DOI'] not in self.publications:
-                # first try to use scopus
-                scopus_search_result = ScopusSearch(f'DOI({p["DOI"]})')
-                if scopus_search_result is not None and scopus_search_result.results is not None and len(scopus_search_result.results) > 0:
-                    self.publications[p['DOI']] = process_scopus_record(
-                        scopus_search_result.results[0], self
-                    )
-                    continue
-                if 'PMC' in p:
-                    p['PMCID'] = p['PMC']
-                    del p['PMC']
-                logging.info(f"adding additional pubmed record {p['DOI']}")
-                self.publications[p['DOI']] = p
-                # convert pmid to int
-                if p['PMID'] is not None:
-                    p['PMID'] = int(p['PMID'])
-
-                try:
-                    self.publications[p]['publication-date'] = utils.get_valid_date(
-                        self.publications[p['DOI']])
-                except TypeError:
-                    print('problem with date:', self.publications[p['DOI']])
-                    continue
+            doi_key = p['DOI'].lower() if p['DOI'] is not None else None
+            if doi_key not in known_dois:
+                pubmed_pubs.setdefault(doi_key, p)
+            else:
+                # the pubmed record already has the pmcid, which saves
+                # looking it up for the matching scopus record
+                copy_pubmed_pmcid(p, self.publications[known_dois[doi_key]])
+        pubmed_pubs = list(pubmed_pubs.values())
+        if maxret is not None:
+            pubmed_pubs = pubmed_pubs[: max(0, maxret - len(self.publications))]
+
+        # first try to use scopus, searching for the dois in batches
+        # (one query per batch), with the batches run concurrently
+        dois = [p['DOI'] for p in pubmed_pubs if p['DOI'] is not None]
+        doi_batches = [
+            dois[i:i + doi_batch_size]
+            for i in range(0, len(dois), doi_batch_size)
+        ]
+        scopus_results = {}
+        for found in utils.rate_limited_map(
+            search_scopus_by_dois,
+            doi_batches,
+            concurrency=concurrency,
+        ):
+            scopus_results.update(found)
+
+        matched_dois = [
+            doi for doi in dois if doi.lower() in scopus_results
+        ]
+        crossref_records = prefetch_crossref_records(
+            [scopus_results[doi.lower()].doi for doi in matched_dois],
+            email=self.metadata.email,
+        )
+        scopus_pubs = dict(
+            zip(
+                matched_dois,
+                utils.rate_limited_map(
+                    lambda doi: process_scopus_record(
+                        scopus_results[doi.lower()],
+                        self,
+                        lookup_pmcid=False,
+                        crossref_records=crossref_records,
+                    ),
+                    matched_dois,
+                    concurrency=concurrency,
+                ),
+            )
+        )
+        for p in pubmed_pubs:
+            if p['DOI'] in scopus_pubs:
+                self.publications[p['DOI']] = scopus_pubs[p['DOI']]
+                copy_pubmed_pmcid(p, self.publications[p['DOI']])
+                continue
+            if 'PMC' in p:
+                p['PMCID'] = p['PMC']
+                del p['PMC']
+            logging.info(f"adding additional pubmed record {p['DOI']}")
+            self.publications[p['DOI']] = p
+            # convert pmid to int
+            if p['PMID'] is not None:
+                p['PMID'] = int(p['PMID'])
+
+            try:
+                self.publications[p['DOI']]['publication-date'] = utils.get_valid_date(
+                    self.publications[p['DOI']])
+            except TypeError:
+                print('problem with date:', self.publications[p['DOI']])
+                continue
+
+        self._add_pmcids()
+
+    def _add_pmcids(self):
+        """
+        look up the missing pmcids for all publications in batches,
+        first by doi with the PMC ID converter and then by pmid with
+        Entrez elink for any that the converter did not resolve
+        """
+        missing = [
+            pub
+            for pub in self.publications.values()
+            if pub is not None
+            and isinstance(pub.get('DOI'), str)
+            and pub.get('PMCID') is None
+        ]
+        try:
+            pmcids = utils.get_pmcids_from_dois(
+                [pub['DOI'] for pub in missing], email=self.metadata.email
+            )
+        except requests.RequestException as e:
+            logging.warning(f'PMC ID converter lookup failed: {e}')
+            pmcids = {}
+        for pub in missing:
+            pub['PMCID'] = pmcids.get(pub['DOI'].lower())
+
+        missing = [
+            pub
+            for pub in self.publications.values()
+            if pub is not None
+            and pub.get('PMID') is not None
+            and pub.get('PMCID') is None
+        ]
+        pmcids = utils.get_pmcids_from_pmids(
+            [pub['PMID'] for pub in missing], email=self.metadata.email
+        )
+        for pub in missing:
+            pub['PMCID'] = pmcids[str(pub['PMID'])]
+
+    def _add_publication(self, record):
+        if record is not None:
+            self.publications[record['DOI']] = record
 
     def get_additional_pubs_from_file(self, pubfile):
         """
         add additional publications from a csv file
         """
-        addl_pubs = pd.read_csv(pubfile)
-        for i in addl_pubs.index:
-            pub = addl_pubs.loc[i].to_dict()
+        addl_pubs = pd.read_csv(pubfile, memory_map=True)
+        for pub in addl_pubs.to_dict('records'):
             pub['title'] = pub['title'].rstrip('.')
             pub['pageRange'] = pub['page']
             del pub['page']
@@ -321,16 +532,7 @@ class Researcher:
             else:
                 pub['publicationName'] = pub['journal']
             del pub['journal']
-            typedict = {
-                'journal-article': ('Journal', 'Article'),
-                'book': ('Book', 'Book'),
-                'book-chapter': ('Book', 'Book Chapter'),
-                'proceedings-article': (
-                    'Conference Proceeding',
-                    'Conference Paper',
-                ),
-            }
-            pub['aggregationType'], pub['subtypeDescription'] = typedict[
+            pub['aggregationType'], pub['subtypeDescription'] = pub_types[
                 pub['type']
             ]
             pub = utils.remove_nans_from_pub(pub)
@@ -339,64 +541,85 @@ class Researcher:
             self.publications[pub['DOI']] = pub
             logging.debug(f'added {pub["DOI"]}:{pub["title"]} from file')
 
-    def add_links_to_publications(self, links_file):
+    def add_links_to_publications(self, links_file, chunksize=1000):
         """
         add links to publications from a csv file
         """
-        links = pd.read_csv(links_file)
-        for i in links.index:
-            doi = links.loc[i].DOI
-            if doi in self.publications:
-                if 'links' not in self.publications[doi]:
-                    self.publications[doi]['links'] = {}
-                self.publications[doi]['links'][links.loc[i].type] = links.loc[
-                    i
-                ].url
-            else:
-                logging.warning(
-                    f'Could not find link DOI {links.loc[i].DOI} in publications'
-                )
+        # read the file in chunks so that memory use does not grow with
+        # its length, iterating over plain tuples rather than Series
+        for links in pd.read_csv(
+            links_file, chunksize=chunksize, memory_map=True
+        ):
+            for link in links.itertuples(index=False):
+                if link.DOI in self.publications:
+                    self.publications[link.DOI].setdefault('links', {})[
+                        link.type
+                    ] = link.url
+                else:
+                    logging.warning(
+                        f'Could not find link DOI {link.DOI} in publications'
+                    )
 
-    def get_coauthors(self):
+    def get_coauthors(self, concurrency=1, rate_limit=None):
+        """
+        get coauthor records from scopus
+
+        Parameters
+        ----------
+        concurrency : int
+            number of author records to retrieve in parallel
+        rate_limit : float
+            maximum number of requests submitted per second (None for no limit)
+        """
 
         if self.publications is None:
             logging.warning('No publications found. Cannot get coauthors.')
             return
-        self.coauthors = {}
+        # gather the publication dates for each coauthor in one pass, so
+        # that each author record is retrieved (and dates sorted) only once
+        coauthor_dates = defaultdict(list)
         for doi, pub in self.publications.items():
-            if 'scopus_coauthor_ids' in pub:
-                for coauthor in pub['scopus_coauthor_ids']:
-                    if coauthor not in self.coauthors:
-                        coauthor_info = AuthorRetrieval(coauthor)
-                        if coauthor_info.indexed_name is None:
-                            continue
-                        if coauthor_info.affiliation_current is None:
-                            affil = None
-                            affil_id = None
-                        else:
-                            affil = [
-                                get_affiliation(aff)
-                                for aff in coauthor_info.affiliation_current
-                            ]
-                            affil_id = [
-                                aff.id
-                                for aff in coauthor_info.affiliation_current
-                            ]
-                        self.coauthors[coauthor] = {
-                            'scopus_id': coauthor,
-                            'name': coauthor_info.indexed_name,
-                            'affiliation': affil,
-                            'affiliation_id': affil_id,
-                            'dates': [pub['publication-date']],
-                            'num_pubs': 1,
-                        }
-                    else:
-                        self.coauthors[coauthor]['num_pubs'] += 1
-                        self.coauthors[coauthor]['dates'].append(
-                            pub['publication-date']
-                        )
-                        self.coauthors[coauthor]['dates'].sort()
-
+            # skip only the authors without a scopus id; there is no
+            # name-based fallback here for the rest of the publication
+            for coauthor in filter(None, pub.get('scopus_coauthor_ids') or []):
+                coauthor_dates[coauthor].append(pub['publication-date'])
+
+        # author records are retrieved in a worker pool, since
+        # pybliometrics blocks on network i/o for each one; only requests
+        # that miss the pybliometrics cache wait on the rate limit
+        utils.share_scopus_session(
+            pool_size=concurrency, limiter=utils.ScopusRateLimiter(rate_limit)
+        )
+        author_records = utils.rate_limited_map(
+            lambda scopus_id: AuthorRetrieval(scopus_id, view=utils.author_view),
+            coauthor_dates,
+            concurrency=concurrency,
+        )
+        self.coauthors = {}
+        for (coauthor, dates), coauthor_info in zip(
+            coauthor_dates.items(), author_records
+        ):
+            if coauthor_info.indexed_name is None:
+                continue
+            if coauthor_info.affiliation_current is None:
+                affil = None
+                affil_id = None
+            else:
+                affil = [
+                    get_affiliation(aff)
+                    for aff in coauthor_info.affiliation_current
+                ]
+                affil_id = [
+                    aff.id for aff in coauthor_info.affiliation_current
+                ]
+            self.coauthors[coauthor] = {
+                'scopus_id': coauthor,
+                'name': coauthor_info.indexed_name,
+                'affiliation': affil,
+                'affiliation_id': affil_id,
+                'dates': sorted(dates),
+                'num_pubs': len(dates),
+            }
 
     def to_database(self, db: database.Database):
         """
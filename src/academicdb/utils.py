@@ -2,17 +2,82 @@
 utility functions
 """
 
+import io
 import os
+import copy
+import re
 import pandas as pd
 import numpy as np
 import random
 import string
 import json
+import toml
 import scholarly
 from contextlib import suppress
 import math
 from Bio import Entrez
 import subprocess
+from xml.etree import ElementTree
+import shelve
+import atexit
+import threading
+from collections import defaultdict, deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import time
+import importlib
+import pybliometrics
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson is optional; it is much faster than the json module for
+# large records
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
+
+# scopus author view used for coauthor lookups: it includes the names and
+# current affiliations, and is smaller than the default ENHANCED view
+author_view = 'STANDARD'
+
+
+# publication fields that are not used when rendering, so they can be
+# left out when reading publications from the database
+unrendered_publication_fields = [
+    'abstract',
+    'author_records',
+    'author_ids',
+    'affiliation_ids',
+    'scopus_coauthor_ids',
+    'authors_abbrev',
+]
+
+# corrections are not listed as publications, so they are filtered out
+# by the database when reading publications for rendering
+rendered_publication_query = {
+    'title': {'$not': re.compile('Corrigendum|Author Correction|Erratum')}
+}
+
+
+def group_publications_by_year(publications):
+    """
+    group publications by year in a single pass, rather than filtering
+    all of the publications once for each year
+
+    returns a dict mapping each year (most recent first) to its
+    publications, sorted by author
+    """
+    by_year = defaultdict(list)
+    for pub in publications:
+        by_year[pub['year']].append(pub)
+    return {
+        year: sorted(by_year[year], key=lambda x: x['authors'])
+        for year in sorted(by_year, reverse=True)
+    }
 
 
 def get_valid_date(pub):
@@ -46,11 +111,33 @@ def serialize_pubs_to_json(pubs, outfile):
             print('WARNING: hash collision')
             p.hash = p.hash + get_random_hash(4)
         pubdict[p.hash] = vars(p)
-    with open(outfile, 'w') as f:
-        json.dump(pubdict, f)
+    dump_json(pubdict, outfile)
     return pubdict
 
 
+def dump_json(obj, outfile):
+    """
+    save an object to a json file, using orjson if it is installed
+
+    parameters:
+    -----------
+    obj: object to save
+    outfile: string, filename to save to
+    """
+    if orjson is not None:
+        with open(outfile, 'wb') as f:
+            f.write(
+                orjson.dumps(
+                    obj,
+                    option=orjson.OPT_NON_STR_KEYS
+                    | orjson.OPT_SERIALIZE_NUMPY,
+                )
+            )
+    else:
+        with open(outfile, 'w') as f:
+            json.dump(obj, f)
+
+
 def shorten_authorlist(authors, maxlen=10, n_to_show=3):
     authors_split = authors.split(',')
     if len(authors_split) > maxlen:
@@ -58,11 +145,24 @@ def shorten_authorlist(authors, maxlen=10, n_to_show=3):
     return authors
 
 
-def load_pubs_from_json(infile):
-    pubdict = {}
+def load_json(infile):
+    """
+    load an object from a json file, using orjson if it is installed
+
+    parameters:
+    -----------
+    infile: string, filename to load from
+    """
+    if orjson is not None:
+        # orjson parses the bytes directly, without decoding to str first
+        with open(infile, 'rb') as f:
+            return orjson.loads(f.read())
     with open(infile) as f:
-        pubdict = json.load(f)
-    return pubdict
+        return json.load(f)
+
+
+def load_pubs_from_json(infile):
+    return load_json(infile)
 
 
 def run_shell_cmd(cmd, cwd=[]):
@@ -81,41 +181,587 @@ def run_shell_cmd(cmd, cwd=[]):
     return stdout_holder
 
 
-def get_pmcid_from_pmid(pmid: str, email: str):
+_scopus_initialized = False
+
+
+def init_scopus():
+    """
+    initialize pybliometrics, once per process
+    """
+    global _scopus_initialized
+    if not _scopus_initialized:
+        pybliometrics.scopus.init()
+        _scopus_initialized = True
+
+
+_entrez_settings = None
+
+
+def init_entrez(email: str, api_key: str = None):
+    """
+    set the Entrez email (and api key, if one is given or set in the
+    NCBI_API_KEY environment variable), only when they have changed
+    """
+    global _entrez_settings
+    if api_key is None:
+        api_key = os.environ.get('NCBI_API_KEY')
+    if _entrez_settings != (email, api_key):
+        Entrez.email = email
+        Entrez.api_key = api_key
+        _entrez_settings = (email, api_key)
+
+
+def entrez_rate_limit():
+    """
+    requests per second allowed by NCBI: 10 with an api key, 3 without
+    """
+    return 3 if Entrez.api_key is None else 10
+
+
+_shared_sessions = {}
+_shared_sessions_lock = threading.Lock()
+
+
+def get_shared_session(name, headers=None, pool_maxsize=10, retries=None):
+    """
+    requests session shared by all requests to one service, so that
+    connections are kept alive across calls; created on first use
+
+    parameters:
+    -----------
+    name: string, name of the service
+    headers: dict, headers sent with every request
+    pool_maxsize: int, number of connections kept open
+    retries: dict, keyword arguments for urllib3's Retry
+    """
+    with _shared_sessions_lock:
+        if name not in _shared_sessions:
+            session = requests.Session()
+            if headers is not None:
+                session.headers.update(headers)
+            session.mount(
+                'https://',
+                HTTPAdapter(
+                    pool_maxsize=pool_maxsize,
+                    max_retries=0 if retries is None else Retry(**retries),
+                ),
+            )
+            _shared_sessions[name] = session
+    return _shared_sessions[name]
+
+
+eutils_url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+
+
+def get_ncbi_session():
+    """
+    session shared by all NCBI requests (Bio.Entrez opens a new
+    connection for each)
+    """
+    # e-utility requests are sent as POST, which urllib3 does not
+    # retry unless told to
+    return get_shared_session(
+        'ncbi',
+        retries=dict(
+            total=3,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=None,
+        ),
+    )
+
+
+def eutils_request(utility: str, **params):
+    """
+    send an E-utilities request over the shared NCBI session, using the
+    email and api key set by init_entrez
+
+    parameters:
+    -----------
+    utility: string, name of the e-utility (e.g. 'esearch', 'efetch')
+    params: query parameters (a list value is sent as a repeated parameter)
+
+    returns the response body as a binary handle, for Entrez.read or
+    ElementTree
+    """
+    params = {'tool': 'academicdb', 'email': Entrez.email, **params}
+    if Entrez.api_key is not None:
+        params['api_key'] = Entrez.api_key
+    response = get_ncbi_session().post(
+        f'{eutils_url}{utility}.fcgi', data=params, timeout=60
+    )
+    response.raise_for_status()
+    return io.BytesIO(response.content)
+
+
+orcid_headers = {'Accept': 'application/vnd.orcid+json'}
+
+
+def get_orcid_session():
+    """
+    session shared by all ORCID requests
+    """
+    return get_shared_session(
+        'orcid',
+        headers=orcid_headers,
+        pool_maxsize=32,
+        retries=dict(
+            total=3, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504]
+        ),
+    )
+
+
+crossref_works_url = 'https://api.crossref.org/works'
+
+
+def get_crossref_session():
+    """
+    session shared by direct CrossRef API requests
+    """
+    return get_shared_session(
+        'crossref',
+        pool_maxsize=32,
+        retries=dict(
+            total=3, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504]
+        ),
+    )
+
+# persistent cache of pmid -> pmcid links, so that reruns do not repeat
+# the Entrez lookups (see get_pmcid_cache)
+pmcid_cache_file = os.path.join(
+    os.path.expanduser('~'), '.cache', 'academicdb', 'pmcid'
+)
+_pmcid_cache = None
+_pmcid_cache_lock = threading.Lock()
+
+
+def get_pmcid_cache():
+    """
+    open the persistent pmcid cache, once per process
+
+    returns None if the cache cannot be opened
+    """
+    global _pmcid_cache
+    if _pmcid_cache is None:
+        try:
+            os.makedirs(os.path.dirname(pmcid_cache_file), exist_ok=True)
+            _pmcid_cache = shelve.open(pmcid_cache_file)
+        except OSError as e:
+            logging.warning(f'could not open pmcid cache: {e}')
+            return None
+        atexit.register(_pmcid_cache.close)
+    return _pmcid_cache
+
+
+def read_pmcid_cache(cache, keys):
+    """
+    look up all of the keys in the pmcid cache in a single pass
+
+    returns a dict mapping each key to its cached pmcid (or None)
+    """
+    if cache is None:
+        return dict.fromkeys(keys)
+    with _pmcid_cache_lock:
+        return {key: cache.get(key) for key in keys}
+
+
+def write_pmcid_cache(cache, links):
+    """store a dict of key -> pmcid links in the pmcid cache"""
+    if cache is None or not links:
+        return
+    with _pmcid_cache_lock:
+        cache.update(links)
+
+
+def get_pmcid_from_pmid(pmid: str, email: str, use_cache: bool = True):
     """
     get the pmcid from the pmid
     """
+    if pmid is None:
+        return None
+    return get_pmcids_from_pmids([pmid], email, use_cache=use_cache)[str(pmid)]
+
+
+def get_pmcids_from_pmids(
+    pmids: list,
+    email: str,
+    batch_size: int = 200,
+    use_cache: bool = True,
+    concurrency: int = 3,
+    rate_limit: float = None,
+):
+    """
+    get the pmcids for a list of pmids, linking up to batch_size pmids
+    in each Entrez elink request
 
-    with Entrez.elink(
-        dbfrom='pubmed',
-        db='pmc',
-        linkname='pubmed_pmc',
-        id=pmid,
-        retmode='text',
-        email=email,
-    ) as handle:
-        record = Entrez.read(handle)
+    up to concurrency requests are in flight at once, submitted at no
+    more than rate_limit per second (by default, the rate that NCBI
+    allows; see entrez_rate_limit)
 
-    try:
-        pmcid = record[0]['LinkSetDb'][0]['Link'][0]['Id']
-        pmcid = pmcid.replace('PMC', '')
-    except Exception:
-        pmcid = None
-    return pmcid
+    pmcids that are found are kept in a persistent cache; missing links
+    are not cached, since a pmcid may be assigned later
+
+    returns a dict mapping each pmid (as a string) to its pmcid (or None)
+    """
+    init_entrez(email)
+    if rate_limit is None:
+        rate_limit = entrez_rate_limit()
+    cache = get_pmcid_cache() if use_cache else None
+    pmcids = read_pmcid_cache(
+        cache, [str(pmid) for pmid in pmids if pmid is not None]
+    )
+    to_lookup = [pmid for pmid, pmcid in pmcids.items() if pmcid is None]
+    batches = [
+        to_lookup[i:i + batch_size]
+        for i in range(0, len(to_lookup), batch_size)
+    ]
+
+    def link_batch(batch):
+        # passing the ids as repeated parameters gives one link set per pmid
+        return parse_pmc_links(
+            eutils_request(
+                'elink',
+                dbfrom='pubmed',
+                db='pmc',
+                linkname='pubmed_pmc',
+                id=batch,
+            )
+        )
+
+    for links in rate_limited_map(
+        link_batch, batches, concurrency=concurrency, rate_limit=rate_limit
+    ):
+        pmcids.update(links)
+        write_pmcid_cache(cache, links)
+    return pmcids
+
+
+def parse_pmc_links(handle):
+    """
+    get the pmcids from an Entrez elink pubmed_pmc response
+
+    only the linked ids are read, using ElementTree, rather than building
+    the full record with Entrez.read
+
+    returns a dict mapping each pmid that has a pmcid to the pmcid
+    """
+    links = {}
+    for linkset in ElementTree.parse(handle).getroot().iter('LinkSet'):
+        pmid = linkset.findtext('IdList/Id')
+        pmcid = linkset.findtext('LinkSetDb/Link/Id')
+        if pmid is not None and pmcid is not None:
+            links[pmid.strip()] = pmcid.strip().replace('PMC', '')
+    return links
+
+
+# NCBI's PMC ID converter maps dois and pmids to pmcids, up to 200 per request
+idconv_url = 'https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/'
+
+
+def get_pmcids_from_dois(
+    dois: list,
+    email: str,
+    batch_size: int = 200,
+    use_cache: bool = True,
+    concurrency: int = 3,
+    rate_limit: float = None,
+):
+    """
+    get the pmcids for a list of dois using the PMC ID converter,
+    which resolves up to batch_size dois in a single request
+
+    found pmcids are cached as in get_pmcids_from_pmids, keyed by the
+    lowercased doi (prefixed with 'doi:') and also by the pmid that the
+    converter returns, so that later pmid lookups are cache hits
+
+    returns a dict mapping each lowercased doi to its pmcid (or None)
+    """
+    init_entrez(email)
+    if rate_limit is None:
+        rate_limit = entrez_rate_limit()
+    cache = get_pmcid_cache() if use_cache else None
+    cached = read_pmcid_cache(
+        cache, [f'doi:{doi.lower()}' for doi in dois if doi is not None]
+    )
+    pmcids = {key[len('doi:'):]: pmcid for key, pmcid in cached.items()}
+    to_lookup = [doi for doi, pmcid in pmcids.items() if pmcid is None]
+    batches = [
+        to_lookup[i:i + batch_size]
+        for i in range(0, len(to_lookup), batch_size)
+    ]
+
+    def convert_batch(batch):
+        response = get_ncbi_session().get(
+            idconv_url,
+            params={
+                'ids': ','.join(batch),
+                'format': 'json',
+                'tool': 'academicdb',
+                'email': email,
+            },
+            timeout=30,
+        )
+        response.raise_for_status()
+        links, cache_links = {}, {}
+        for record in response.json().get('records', []):
+            if record.get('pmcid') and record.get('doi'):
+                pmcid = record['pmcid'].replace('PMC', '')
+                links[record['doi'].lower()] = pmcid
+                cache_links[f"doi:{record['doi'].lower()}"] = pmcid
+                if record.get('pmid'):
+                    cache_links[str(record['pmid'])] = pmcid
+        return links, cache_links
+
+    for links, cache_links in rate_limited_map(
+        convert_batch, batches, concurrency=concurrency, rate_limit=rate_limit
+    ):
+        pmcids.update(links)
+        write_pmcid_cache(cache, cache_links)
+    return pmcids
+
+
+class TokenBucket:
+    """
+    thread-safe token bucket used to limit the rate of API requests
+    while allowing several requests to be in flight at once
+
+    parameters:
+    -----------
+    rate: float, number of requests allowed per second (None for no limit)
+    capacity: int, maximum number of requests that can be issued in a burst
+    """
+
+    def __init__(self, rate=None, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """block until a token is available"""
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.last) * self.rate
+                )
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ScopusRateLimiter(TokenBucket):
+    """
+    token bucket that also paces requests using the quota headers
+    returned by the Scopus API, slowing down as the key's remaining
+    quota runs low rather than running into 429 errors
+
+    parameters:
+    -----------
+    rate: float, number of requests allowed per second (None for no limit)
+    capacity: int, maximum number of requests that can be issued in a burst
+    low_water: int, remaining quota below which requests are spread out
+        over the time left until the quota resets
+    max_delay: float, longest time (in seconds) to wait between requests
+    """
+
+    def __init__(self, rate=None, capacity=1, low_water=100, max_delay=60):
+        super().__init__(rate, capacity)
+        self.low_water = low_water
+        self.max_delay = max_delay
+        self.remaining = None
+        self.reset_ts = None
+
+    def update(self, response, *args, **kwargs):
+        """response hook that records the quota headers from scopus"""
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset_ts = response.headers.get('X-RateLimit-Reset')
+        if remaining is not None and reset_ts is not None:
+            with self.lock:
+                self.remaining = int(remaining)
+                self.reset_ts = float(reset_ts)
+        return response
+
+    def delay(self):
+        """time to wait before the next request, based on the remaining quota"""
+        with self.lock:
+            if self.remaining is None or self.remaining > self.low_water:
+                return 0
+            # no point waiting on an exhausted key: its next request gets a
+            # 429, which the shared session passes through (it does not
+            # retry 429) so that pybliometrics switches to the next key
+            if self.remaining == 0:
+                return 0
+            wait = (self.reset_ts - time.time()) / self.remaining
+        return min(self.max_delay, max(0, wait))
+
+    def acquire(self):
+        """block until a token is available and the quota allows a request"""
+        super().acquire()
+        wait = self.delay()
+        if wait > 0:
+            time.sleep(wait)
+
+
+def rate_limited_map(func, items, concurrency=1, rate_limit=None):
+    """
+    apply func to each item in a pool of worker threads, so that several
+    API requests can be in flight while respecting the rate limit
+
+    parameters:
+    -----------
+    func: function to apply to each item
+    items: iterable of items
+    concurrency: int, number of worker threads
+    rate_limit: float, maximum number of items submitted per second,
+        or a TokenBucket to share a limit across calls
+
+    yields the results in the same order as items
+    """
+    if isinstance(rate_limit, TokenBucket):
+        bucket = rate_limit
+    else:
+        bucket = TokenBucket(rate_limit)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for item in items:
+            bucket.acquire()
+            pending.append(pool.submit(func, item))
+            # hand back finished results without letting the queue grow
+            while len(pending) > concurrency or (
+                pending and pending[0].done()
+            ):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that takes a token from its limiter before each request
+    that goes out over the network, so that results served from the
+    pybliometrics cache do not wait on the rate limit
+    """
+
+    def __init__(self, *args, limiter=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter
+
+    def send(self, request, *args, **kwargs):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        return super().send(request, *args, **kwargs)
+
+
+def find_get_content_modules():
+    """
+    find the pybliometrics modules whose get_session builds the session
+    for each Scopus request
+
+    the Scopus classes call the get_content function imported by
+    pybliometrics' Base class, whose module has moved between versions,
+    so it is looked up from there; the older location is included if it
+    still exists. The utils packages re-export get_content under the same
+    name as its module, so the modules are imported directly.
+    """
+    module_names = []
+    with suppress(ImportError, AttributeError):
+        base = importlib.import_module('pybliometrics.superclasses.base')
+        module_names.append(base.get_content.__module__)
+    module_names.append('pybliometrics.scopus.utils.get_content')
+    modules = []
+    for module_name in dict.fromkeys(module_names):
+        with suppress(ImportError):
+            module = importlib.import_module(module_name)
+            if hasattr(module, 'get_session'):
+                modules.append(module)
+    if not modules:
+        raise RuntimeError(
+            'could not find the pybliometrics get_session function'
+        )
+    return modules
+
+
+# session shared by all pybliometrics requests (see share_scopus_session)
+_scopus_session = None
+_scopus_pool_size = 0
+
+
+def share_scopus_session(pool_size=1, limiter=None):
+    """
+    make pybliometrics reuse a single requests session, so that
+    TCP/TLS connections to the Scopus API are kept alive across calls
+
+    parameters:
+    -----------
+    pool_size: int, number of connections to keep in the pool
+        (should be at least the number of concurrent workers)
+    limiter: ScopusRateLimiter that paces the requests sent over the
+        network and is updated from the response headers
+    """
+    get_content_modules = find_get_content_modules()
+
+    # keep the existing session (and its open connections) if there is one,
+    # only replacing the adapter if a larger pool is needed
+    global _scopus_session, _scopus_pool_size
+    if _scopus_session is None:
+        _scopus_session = requests.Session()
+    session = _scopus_session
+    if pool_size > _scopus_pool_size:
+        # back off exponentially on server errors; 429 is not retried here,
+        # since pybliometrics handles it by switching to the next api key
+        retries = Retry(
+            total=5,
+            backoff_factor=1,
+            status_forcelist=[500, 501, 502, 503, 504, 524],
+        )
+        # all requests go to the one Scopus host, so a single pool that is
+        # as large as the number of workers is enough
+        adapter = RateLimitedAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=retries,
+            limiter=getattr(session.get_adapter('https://'), 'limiter', None),
+        )
+        session.mount('https://', adapter)
+        _scopus_pool_size = pool_size
+    if limiter is not None:
+        session.get_adapter('https://').limiter = limiter
+        session.hooks['response'] = [limiter.update]
+    for get_content in get_content_modules:
+        get_content.get_session = lambda: session
+    return session
+
+
+# titles containing these strings are corrections rather than publications
+default_skip_strings = (
+    'corrigendum',
+    'erratum',
+    'author correction',
+    'publisher correction',
+)
 
 
 def has_skip_strings(target, skip_strings=None):
     if skip_strings is None:
-        skip_strings = [
-            'corrigendum',
-            'erratum',
-            'author correction',
-            'publisher correction',
-        ]
-    for skip_string in skip_strings:
-        if target.lower().find(skip_string) > -1:
-            return True
-    return False
+        skip_strings = default_skip_strings
+    target = target.lower()
+    return any(skip_string in target for skip_string in skip_strings)
+
+
+def has_scopus_coauthor_ids(pub: dict):
+    """
+    check whether every author of the publication has a scopus id
+    - an empty list or a missing/empty id means the record is incomplete
+    """
+    author_ids = pub.get('scopus_coauthor_ids')
+    return bool(author_ids) and all(author_ids)
 
 
 def remove_nans_from_pub(pub: dict):
@@ -129,11 +775,18 @@ def remove_nans_from_pub(pub: dict):
     return pub
 
 
-def load_config(configfile):
-    import toml
+@lru_cache(maxsize=None)
+def _read_config(configfile):
+    return toml.load(configfile)
+
 
-    config = toml.load(configfile)
-    return config
+def load_config(configfile):
+    """
+    load a toml config file, parsing each file once per process (setup_db
+    and the command that calls it both read the config); each caller gets
+    its own copy, so changes made by one are not seen by the others
+    """
+    return copy.deepcopy(_read_config(configfile))
 
 
 def get_random_hash(length=16):
@@ -0,0 +1,60 @@
+## tests for the crossref_utils module
+from src.academicdb import crossref_utils, recordConverter, utils
+
+
+class Response:
+    def __init__(self, items):
+        self.items = items
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'message': {'items': self.items}}
+
+
+def test_fetch_crossref_batch(monkeypatch):
+    sent = []
+
+    def get(url, params, timeout):
+        sent.append(params)
+        dois = [f[len('doi:'):] for f in params['filter'].split(',')]
+        return Response([{'DOI': doi.upper()} for doi in dois])
+
+    monkeypatch.setattr(utils.get_crossref_session(), 'get', get)
+    records = crossref_utils.fetch_crossref_batch(
+        ['10.1/a', '10.1/b', '10.1/c', '10.1/x,y'],
+        mailto='x@y.org',
+        batch_size=2,
+    )
+    assert all(p['mailto'] == 'x@y.org' for p in sent)
+    assert sorted(p['filter'] for p in sent) == [
+        'doi:10.1/a,doi:10.1/b',
+        'doi:10.1/c',
+    ]
+    assert sorted(records) == ['10.1/a', '10.1/b', '10.1/c']
+
+
+def test_scopus_converter_uses_batched_record(monkeypatch):
+    class Works:
+        def doi(self, doi):
+            raise AssertionError('batched record should be used')
+
+    class ScopusRecord:
+        doi = '10.1/a'
+        author_ids = '1;2'
+
+    monkeypatch.setattr(recordConverter, 'Works', Works)
+    record = {
+        'DOI': '10.1/a',
+        'type': 'journal-article',
+        'title': ['A title'],
+        'author': [{'family': 'Smith', 'given': 'John'}],
+        'container-title': ['A journal'],
+        'published-print': {'date-parts': [[2020]]},
+    }
+    pub = recordConverter.ScopusRecordConverter(
+        ScopusRecord(), 'x@y.org', crossref_record=record
+    ).convert()
+    assert pub['year'] == 2020
+    assert pub['scopus_coauthor_ids'] == ['1', '2']
@@ -1,9 +1,11 @@
 import pytest
+import pymongo.errors
 import sys
 
 sys.path.append('../academicdb')
 from src.academicdb.database import AbstractDatabase
 from src.academicdb.database import MongoDatabase
+from src.academicdb.database import log_write_errors
 
 dbname = 'testdb'
 
@@ -39,6 +41,12 @@ def test_add(mongodb):
     assert len(list(mongodb.client.testdb.test.find({}))) == 1
 
 
+def test_add_replaces_metadata(mongodb):
+    mongodb.add('metadata', [{'lastname': 'a'}])
+    mongodb.add('metadata', [{'lastname': 'b'}])
+    assert mongodb.get_collection('metadata') == [{'lastname': 'b'}]
+
+
 def test_get_collection(mongodb):
     mongodb.add('test', [{'a': 1, 'b': 2}])
     assert len(mongodb.get_collection('test')) == 1
@@ -47,3 +55,61 @@ def test_get_collection(mongodb):
 def test_drop(mongodb):
     mongodb.add('test', [{'a': 1, 'b': 2}])
     mongodb.drop_collection('test')
+
+
+def test_add_publications_batched(mongodb):
+    pubs = [{'DOI': f'10.1000/{i}', 'title': f'pub {i}'} for i in range(5)]
+    mongodb.add('publications', pubs, batch_size=2)
+    # re-adding should update rather than duplicate
+    mongodb.add('publications', pubs, batch_size=2)
+    assert len(list(mongodb.client.testdb.publications.find({}))) == 5
+
+
+def test_add_batched(mongodb):
+    items = [{'a': i} for i in range(5)]
+    mongodb.add('test', items, batch_size=2)
+    assert len(mongodb.get_collection('test')) == 5
+
+
+def test_iter_collection_fields(mongodb):
+    pubs = [{'DOI': f'10.1000/{i}', 'title': f'pub {i}'} for i in range(3)]
+    mongodb.add('publications', pubs)
+    records = list(mongodb.iter_collection('publications', fields=['DOI']))
+    assert len(records) == 3
+    assert all('title' not in record for record in records)
+
+
+def test_add_empty_creates_collection(mongodb):
+    mongodb.add('empty', [])
+    assert 'empty' in mongodb.list_collections()
+
+
+def test_iter_collection_query(mongodb):
+    pubs = [
+        {'DOI': f'10.1000/{i}', 'publication-date': f'20{10 + i}-01-01'}
+        for i in range(3)
+    ]
+    mongodb.add('publications', pubs)
+    records = list(mongodb.iter_collection(
+        'publications', query={'publication-date': {'$gte': '2011-01-01'}}
+    ))
+    assert len(records) == 2
+
+
+def test_add_publications_repeated_doi(mongodb):
+    pubs = [
+        {'DOI': '10.1000/1', 'title': 'first'},
+        {'DOI': '10.1000/1', 'title': 'second'},
+    ]
+    mongodb.add('publications', pubs)
+    records = list(mongodb.client.testdb.publications.find({}))
+    assert [r['title'] for r in records] == ['second']
+
+
+def test_log_write_errors(caplog):
+    error = pymongo.errors.BulkWriteError(
+        {'writeErrors': [{'errmsg': 'duplicate key', 'op': {'DOI': 'a'}}]}
+    )
+    with log_write_errors('publications'):
+        raise error
+    assert 'duplicate key' in caplog.text
@@ -0,0 +1,131 @@
+import pytest
+import sys
+
+sys.path.append('../academicdb')
+from src.academicdb.get_collaborators import (
+    Coauthor,
+    get_coauthors,
+    combine_coauthors,
+    coauthors_to_df,
+    normalize_name,
+)
+
+
+@pytest.fixture
+def generic_pubs():
+    return [
+        {
+            'authors_abbrev': ['Smith J', 'Poldrack RA', 'Doe A'],
+            'publication-date': '2020-05-01',
+        },
+        {
+            'authors_abbrev': ['Smith J'],
+            'publication-date': '2021-05-01',
+        },
+    ]
+
+
+def test_generic_coauthors(generic_pubs):
+    coauthors = get_coauthors(generic_pubs)
+    assert len(coauthors) == 2
+    for coauthor in coauthors.values():
+        assert isinstance(coauthor, Coauthor)
+        assert coauthor.pubtype == 'generic'
+    names = {coauthor.name: coauthor for coauthor in coauthors.values()}
+    # most recent collaboration date is kept
+    assert names['Smith, J'].date == '2021-05-01'
+
+
+def test_combine_coauthors(generic_pubs):
+    coauthors = get_coauthors(generic_pubs)
+    combined, skipped = combine_coauthors(coauthors, verbose=False)
+    assert len(combined) == 2
+    assert skipped == []
+
+
+def test_coauthors_to_df(generic_pubs):
+    coauthors, _ = combine_coauthors(
+        get_coauthors(generic_pubs), verbose=False
+    )
+    coauthor_df = coauthors_to_df(coauthors, nyears=100)
+    assert list(coauthor_df.columns) == [
+        'type', 'name', 'affiliation', 'email', 'date'
+    ]
+    assert list(coauthor_df.name) == ['Doe, A', 'Smith, J']
+    assert coauthors_to_df(coauthors, nyears=0).empty
+
+
+def test_combine_coauthors_merges_generic_into_scopus():
+    coauthors = {
+        '123': Coauthor(
+            pubtype='scopus', scopus_id='123', name='Smith, John',
+            affiliation=['Stanford'], affiliation_id=['1'],
+            date='2019-01-01', year=2019, name_abbrev='Smith J',
+        ),
+        hash('Smith J'): Coauthor(
+            pubtype='generic', scopus_id=None, name='Smith, J',
+            affiliation=None, affiliation_id=None,
+            date='2022-03-01', year=2022,
+        ),
+    }
+    combined, skipped = combine_coauthors(coauthors, verbose=False)
+    assert list(combined) == ['123']
+    assert combined['123'].date == '2022-03-01'
+    assert skipped == []
+
+
+def make_coauthors(scopus_names, generic_names):
+    coauthors = {}
+    for i, name_abbrev in enumerate(scopus_names):
+        coauthors[str(i)] = Coauthor(
+            pubtype='scopus', scopus_id=str(i), name=name_abbrev,
+            affiliation=['Stanford'], affiliation_id=['1'],
+            date='2019-01-01', year=2019, name_abbrev=name_abbrev,
+        )
+    for name in generic_names:
+        coauthors[hash(name)] = Coauthor(
+            pubtype='generic', scopus_id=None, name=name,
+            affiliation=None, affiliation_id=None,
+            date='2022-03-01', year=2022,
+        )
+    return coauthors
+
+
+def test_combine_coauthors_match_initials():
+    coauthors = make_coauthors(['Smith JA'], ['Smith, JAX'])
+    combined, skipped = combine_coauthors(coauthors, verbose=False)
+    assert len(combined) == 2
+    combined, skipped = combine_coauthors(
+        coauthors, verbose=False, match_initials=True
+    )
+    assert list(combined) == ['0']
+    assert combined['0'].date == '2022-03-01'
+
+
+@pytest.mark.parametrize(
+    'scopus_names, generic_name',
+    [
+        (['Anderson K'], 'Anderson, J'),
+        (['Mumford JB'], 'Mumford, JA'),
+        (['van der Berg B'], 'van der Berg, A'),
+        (['Smith JA'], 'Smith'),
+        # ambiguous: J could be either scopus coauthor
+        (['Smith JA', 'Smith JB'], 'Smith, J'),
+    ],
+)
+def test_combine_coauthors_keeps_different_people(scopus_names, generic_name):
+    coauthors = make_coauthors(scopus_names, [generic_name])
+    combined, skipped = combine_coauthors(
+        coauthors, verbose=False, match_initials=True
+    )
+    assert len(combined) == len(scopus_names) + 1
+
+
+def test_normalize_name():
+    assert normalize_name("O'Brien J") == normalize_name('OBrien J')
+    assert normalize_name('Müller A') == 'muller a'
+
+
+def test_normalize_name_whitespace():
+    assert normalize_name('Smith,  J. ') == 'smith j'
+    assert normalize_name('Smith, J') == 'smith j'
@@ -145,3 +145,11 @@ def test_md_reference_book(book_dict):
         ref
         == 'Poldrack RA, Mumford JA, Nichols TE (2011). *Handbook of Functional MRI Data Analysis*. Cambridge: Cambridge University Press.'
     )
+
+
+def test_shorten_authorlist():
+    from src.academicdb.publication_utils import shorten_authorlist
+
+    authors = ', '.join(f'Author{i} A' for i in range(1000))
+    assert shorten_authorlist(authors) == 'Author0 A, Author1 A, Author2 A et al.'
+    assert shorten_authorlist('Smith J,  Doe A ') == 'Smith J, Doe A'
@@ -34,3 +34,21 @@ def test_no_records_returned(email):
     results = pubmed_search.query(query_string)
 
     assert results is None
+
+
+def test_records_fetched_in_batches(email, monkeypatch):
+    from src.academicdb import query
+
+    starts = []
+
+    def eutils_request(utility, retstart=None, retmax=None, **kwargs):
+        if utility == 'esearch':
+            return {'Count': '5', 'WebEnv': 'env', 'QueryKey': '1'}
+        starts.append(retstart)
+        return {'PubmedArticle': list(range(retstart, retstart + retmax))}
+
+    monkeypatch.setattr(query.utils, 'eutils_request', eutils_request)
+    monkeypatch.setattr(query.Entrez, 'read', lambda handle: handle)
+    results = PubmedQuery(email=email).query('test', batch_size=2)
+    assert results == [0, 1, 2, 3, 4]
+    assert sorted(starts) == [0, 2, 4]
@@ -11,7 +11,11 @@ import tomli_w
 myPath = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, os.path.join(myPath, '../academcicdb'))
 
-from src.academicdb.researcher import Researcher, researcher_fields
+from src.academicdb.researcher import (
+    Researcher,
+    researcher_fields,
+    copy_pubmed_pmcid,
+)
 
 
 @pytest.fixture(scope='session')
@@ -94,3 +98,35 @@ def test_get_coauthors(researcher):
     researcher.get_publications(maxret=5)
     researcher.get_coauthors()
     assert len(researcher.coauthors) >= len(researcher.publications)
+
+
+def test_copy_pubmed_pmcid():
+    pub = {'DOI': '10.1/abc', 'PMCID': None}
+    copy_pubmed_pmcid({'PMC': 'PMC12345'}, pub)
+    assert pub['PMCID'] == '12345'
+    # an existing pmcid is kept
+    copy_pubmed_pmcid({'PMC': 'PMC99999'}, pub)
+    assert pub['PMCID'] == '12345'
+
+
+def test_get_coauthors_skips_missing_ids(monkeypatch):
+    from src.academicdb import researcher as researcher_module
+
+    class AuthorRecord:
+        def __init__(self, scopus_id, view=None):
+            self.indexed_name = f'Author {scopus_id}'
+            self.affiliation_current = None
+
+    monkeypatch.setattr(researcher_module, 'AuthorRetrieval', AuthorRecord)
+    monkeypatch.setattr(
+        researcher_module.utils, 'share_scopus_session', lambda **kw: None
+    )
+    r = Researcher.__new__(Researcher)
+    r.publications = {
+        '10.1/a': {
+            'scopus_coauthor_ids': ['1', '', '2'],
+            'publication-date': '2020-01-01',
+        },
+    }
+    r.get_coauthors()
+    assert sorted(r.coauthors) == ['1', '2']
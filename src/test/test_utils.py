@@ -0,0 +1,265 @@
+import pytest
+import io
+import sys
+
+sys.path.append('../academicdb')
+from src.academicdb import utils
+
+
+def test_has_scopus_coauthor_ids():
+    assert utils.has_scopus_coauthor_ids({'scopus_coauthor_ids': ['1', '2']})
+
+
+def test_has_scopus_coauthor_ids_incomplete():
+    assert not utils.has_scopus_coauthor_ids({})
+    assert not utils.has_scopus_coauthor_ids({'scopus_coauthor_ids': []})
+    assert not utils.has_scopus_coauthor_ids(
+        {'scopus_coauthor_ids': ['1', '']}
+    )
+
+
+def test_token_bucket_no_limit():
+    bucket = utils.TokenBucket()
+    for _ in range(100):
+        bucket.acquire()
+
+
+def test_token_bucket_limits_rate():
+    bucket = utils.TokenBucket(rate=50)
+    start = utils.time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # first token is available immediately, the rest at 50/s
+    assert utils.time.monotonic() - start >= 0.09
+
+
+def test_rate_limited_map_preserves_order():
+    results = list(
+        utils.rate_limited_map(lambda x: x * 2, range(10), concurrency=3)
+    )
+    assert results == [x * 2 for x in range(10)]
+
+
+class _Response:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+def test_scopus_rate_limiter_paces_low_quota():
+    limiter = utils.ScopusRateLimiter(low_water=10)
+    assert limiter.delay() == 0
+    reset_ts = utils.time.time() + 5
+    limiter.update(_Response({
+        'X-RateLimit-Remaining': '1000',
+        'X-RateLimit-Reset': str(reset_ts),
+    }))
+    assert limiter.delay() == 0
+    limiter.update(_Response({
+        'X-RateLimit-Remaining': '10',
+        'X-RateLimit-Reset': str(reset_ts),
+    }))
+    assert 0 < limiter.delay() <= 0.5
+
+
+def test_dump_json(tmp_path):
+    outfile = tmp_path / 'test.json'
+    utils.dump_json({'a': [1, 2], 3: 'b'}, outfile)
+    assert utils.load_pubs_from_json(outfile) == {'a': [1, 2], '3': 'b'}
+
+
+def test_share_scopus_session_reuses_session():
+    from pybliometrics.superclasses import base
+    import importlib
+
+    session = utils.share_scopus_session(pool_size=2)
+    # the get_session used by the Scopus classes (e.g. AuthorRetrieval)
+    # returns the shared session
+    get_content = importlib.import_module(base.get_content.__module__)
+    assert get_content.get_session() is session
+    assert utils.share_scopus_session(pool_size=4) is session
+    limiter = utils.ScopusRateLimiter()
+    utils.share_scopus_session(limiter=limiter)
+    assert session.hooks['response'] == [limiter.update]
+    assert session.get_adapter('https://').limiter is limiter
+    # a larger pool keeps the limiter
+    utils.share_scopus_session(pool_size=8)
+    assert session.get_adapter('https://').limiter is limiter
+    # 429 is left to pybliometrics, which switches api keys
+    assert 429 not in session.get_adapter('https://').max_retries.status_forcelist
+
+
+def scopus_get_session():
+    """the get_session called by the pybliometrics Scopus classes"""
+    from pybliometrics.superclasses import base
+    import importlib
+
+    return importlib.import_module(base.get_content.__module__).get_session
+
+
+def mock_scopus_send(monkeypatch, remaining):
+    import time
+    import requests
+
+    def send(self, request, *args, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{}'
+        response.headers['X-RateLimit-Remaining'] = str(remaining)
+        response.headers['X-RateLimit-Reset'] = str(time.time() + 100)
+        response.url = request.url
+        response.request = request
+        return response
+
+    monkeypatch.setattr(utils.requests.adapters.HTTPAdapter, 'send', send)
+
+
+def test_scopus_request_waits_on_limiter(monkeypatch):
+    mock_scopus_send(monkeypatch, remaining=5000)
+    waits = []
+    monkeypatch.setattr(utils.time, 'sleep', waits.append)
+    limiter = utils.ScopusRateLimiter()
+    # a nearly exhausted quota spreads requests out until it resets
+    limiter.remaining = 1
+    limiter.reset_ts = utils.time.time() + 30
+    utils.share_scopus_session(pool_size=2, limiter=limiter)
+    scopus_get_session()().get('https://api.elsevier.com/content/author')
+    assert len(waits) == 1 and 0 < waits[0] <= 30
+
+
+def test_get_pmcid_from_pmid_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'pmcid_cache_file', str(tmp_path / 'pmcid'))
+    monkeypatch.setattr(utils, '_pmcid_cache', None)
+    utils.get_pmcid_cache()['12345'] = '67890'
+    # a cache hit does not touch Entrez
+    monkeypatch.setattr(utils, 'eutils_request', None)
+    assert utils.get_pmcid_from_pmid('12345', email='test@test.org') == '67890'
+
+
+def test_parse_pmc_links():
+    xml = b"""<?xml version="1.0" ?>
+<eLinkResult>
+<LinkSet><DbFrom>pubmed</DbFrom><IdList><Id>111</Id></IdList>
+<LinkSetDb><DbTo>pmc</DbTo><LinkName>pubmed_pmc</LinkName>
+<Link><Id>222</Id></Link></LinkSetDb></LinkSet>
+<LinkSet><DbFrom>pubmed</DbFrom><IdList><Id>333</Id></IdList></LinkSet>
+</eLinkResult>"""
+    assert utils.parse_pmc_links(io.BytesIO(xml)) == {'111': '222'}
+
+
+def test_get_pmcids_from_dois(monkeypatch):
+    class Response:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {'records': [
+                {'doi': '10.1/ABC', 'pmid': '1', 'pmcid': 'PMC2'},
+                {'doi': '10.1/def', 'status': 'error'},
+            ]}
+
+    calls = []
+
+    def get(url, params, timeout):
+        calls.append(params['ids'])
+        return Response()
+
+    monkeypatch.setattr(utils.get_ncbi_session(), 'get', get)
+    pmcids = utils.get_pmcids_from_dois(
+        ['10.1/abc', '10.1/def'], email='test@test.org', use_cache=False
+    )
+    assert pmcids == {'10.1/abc': '2', '10.1/def': None}
+    assert calls == ['10.1/abc,10.1/def']
+
+
+def test_init_entrez(monkeypatch):
+    monkeypatch.setattr(utils, '_entrez_settings', None)
+    monkeypatch.setattr(utils.Entrez, 'email', None)
+    monkeypatch.setattr(utils.Entrez, 'api_key', None)
+    monkeypatch.delenv('NCBI_API_KEY', raising=False)
+    utils.init_entrez('test@test.org')
+    assert utils.Entrez.email == 'test@test.org'
+    assert utils.entrez_rate_limit() == 3
+
+    monkeypatch.setenv('NCBI_API_KEY', 'abc')
+    utils.init_entrez('test@test.org')
+    assert utils.Entrez.api_key == 'abc'
+    assert utils.entrez_rate_limit() == 10
+
+
+def test_pmcid_cache_shared_by_doi_and_pmid(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'pmcid_cache_file', str(tmp_path / 'pmcid'))
+    monkeypatch.setattr(utils, '_pmcid_cache', None)
+
+    class Response:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {'records': [
+                {'doi': '10.1/abc', 'pmid': '12345', 'pmcid': 'PMC67890'},
+            ]}
+
+    monkeypatch.setattr(
+        utils.get_ncbi_session(), 'get', lambda *a, **k: Response()
+    )
+    utils.get_pmcids_from_dois(['10.1/ABC'], email='test@test.org')
+    # the pmid returned by the converter is cached too
+    monkeypatch.setattr(utils, 'eutils_request', None)
+    assert utils.get_pmcid_from_pmid('12345', email='test@test.org') == '67890'
+
+
+def test_eutils_request(monkeypatch):
+    class Response:
+        content = b'<xml/>'
+
+        def raise_for_status(self):
+            pass
+
+    sent = {}
+
+    def post(url, data, timeout):
+        sent.update(data, url=url)
+        return Response()
+
+    monkeypatch.setattr(utils.get_ncbi_session(), 'post', post)
+    monkeypatch.setattr(utils.Entrez, 'api_key', 'abc')
+    handle = utils.eutils_request('elink', id=['1', '2'])
+    assert handle.read() == b'<xml/>'
+    assert sent['url'].endswith('/elink.fcgi')
+    assert sent['id'] == ['1', '2']
+    assert sent['api_key'] == 'abc'
+
+
+def test_get_orcid_session():
+    session = utils.get_orcid_session()
+    assert utils.get_orcid_session() is session
+    assert session.headers['Accept'] == 'application/vnd.orcid+json'
+    retries = session.get_adapter('https://pub.orcid.org').max_retries
+    assert 429 in retries.status_forcelist
+
+
+def test_group_publications_by_year():
+    pubs = [
+        {'year': 2020, 'authors': 'b'},
+        {'year': 2021, 'authors': 'c'},
+        {'year': 2020, 'authors': 'a'},
+    ]
+    grouped = utils.group_publications_by_year(pubs)
+    assert list(grouped) == [2021, 2020]
+    assert [p['authors'] for p in grouped[2020]] == ['a', 'b']
+
+
+def test_load_config_returns_copies(tmp_path):
+    configfile = tmp_path / 'config.toml'
+    configfile.write_text('[researcher]\nlastname = "smith"\n')
+    config = utils.load_config(str(configfile))
+    config['researcher']['lastname'] = 'jones'
+    assert utils.load_config(str(configfile))['researcher']['lastname'] == 'smith'
+
+
+def test_scopus_limiter_reads_quota_headers(monkeypatch):
+    mock_scopus_send(monkeypatch, remaining=42)
+    limiter = utils.ScopusRateLimiter()
+    utils.share_scopus_session(pool_size=2, limiter=limiter)
+    scopus_get_session()().get('https://api.elsevier.com/content/author')
+    assert limiter.remaining == 42